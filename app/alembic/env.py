@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -5,10 +6,17 @@ from sqlalchemy import pool
 
 from alembic import context
 
+from app.database import database_url
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# DATABASE_URL points migrations at the same database as the app
+if os.environ.get("DATABASE_URL"):
+    url = database_url(os.environ["DATABASE_URL"]).render_as_string(hide_password=False)
+    config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,131 @@
+"""structured barcodecache
+
+Revision ID: 335e9d33f163
+Revises: eeb3d38d1850
+Create Date: 2026-10-18 16:29:41.704034
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '335e9d33f163'
+down_revision: Union[str, None] = 'eeb3d38d1850'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CHUNK_SIZE = 1000
+
+barcodecache = sa.table(
+    "barcodecache",
+    sa.column("barcode", sa.String),
+    sa.column("data", sa.String),
+    sa.column("name", sa.String),
+    sa.column("brand", sa.String),
+    sa.column("package_quantity", sa.String),
+    sa.column("fetched_at", sa.DateTime),
+)
+
+
+def parse_data(data: str) -> dict:
+    """Split the old "name (brand) - quantity" string, "-" stood for a missing value."""
+    rest, separator, quantity = data.rpartition(" - ")
+    if not separator:
+        rest, quantity = data, "-"
+    name, brand = rest, "-"
+    if rest.endswith(")") and " (" in rest:
+        name, _, brand = rest[:-1].rpartition(" (")
+    return {
+        "name": name or "-",
+        "brand": None if brand == "-" else brand,
+        "package_quantity": None if quantity == "-" else quantity,
+    }
+
+
+def chunks(connection, columns):
+    """Yield rows in barcode order, CHUNK_SIZE at a time, without holding the table in memory."""
+    last_barcode = ""
+    while rows := connection.execute(
+        sa.select(barcodecache.c.barcode, *columns)
+        .where(barcodecache.c.barcode > last_barcode)
+        .order_by(barcodecache.c.barcode)
+        .limit(CHUNK_SIZE)
+    ).all():
+        yield rows
+        last_barcode = rows[-1].barcode
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("barcodecache") as batch_op:
+        batch_op.add_column(sa.Column("name", sqlmodel.AutoString(), nullable=True))
+        batch_op.add_column(sa.Column("brand", sqlmodel.AutoString(), nullable=True))
+        batch_op.add_column(sa.Column("package_quantity", sqlmodel.AutoString(), nullable=True))
+        batch_op.add_column(sa.Column("fetched_at", sa.DateTime(), nullable=True))
+
+    connection = op.get_bind()
+    fetched_at = datetime.today()
+    update = (
+        barcodecache.update()
+        .where(barcodecache.c.barcode == sa.bindparam("b_barcode"))
+        .values(
+            name=sa.bindparam("name"),
+            brand=sa.bindparam("brand"),
+            package_quantity=sa.bindparam("package_quantity"),
+            fetched_at=sa.bindparam("fetched_at"),
+        )
+    )
+    for rows in chunks(connection, [barcodecache.c.data]):
+        connection.execute(
+            update,
+            [
+                {"b_barcode": row.barcode, "fetched_at": fetched_at, **parse_data(row.data)}
+                for row in rows
+            ],
+        )
+
+    with op.batch_alter_table("barcodecache") as batch_op:
+        batch_op.alter_column("name", existing_type=sqlmodel.AutoString(), nullable=False)
+        batch_op.alter_column("fetched_at", existing_type=sa.DateTime(), nullable=False)
+        batch_op.drop_column("data")
+        batch_op.create_index("ix_barcodecache_name", ["name"])
+        batch_op.create_index("ix_barcodecache_brand", ["brand"])
+        batch_op.create_index("ix_barcodecache_fetched_at", ["fetched_at"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("barcodecache") as batch_op:
+        batch_op.add_column(sa.Column("data", sqlmodel.AutoString(), nullable=True))
+
+    connection = op.get_bind()
+    update = (
+        barcodecache.update()
+        .where(barcodecache.c.barcode == sa.bindparam("b_barcode"))
+        .values(data=sa.bindparam("data"))
+    )
+    columns = [barcodecache.c.name, barcodecache.c.brand, barcodecache.c.package_quantity]
+    for rows in chunks(connection, columns):
+        connection.execute(
+            update,
+            [
+                {
+                    "b_barcode": row.barcode,
+                    "data": f'{row.name} ({row.brand or "-"}) - {row.package_quantity or "-"}',
+                }
+                for row in rows
+            ],
+        )
+
+    with op.batch_alter_table("barcodecache") as batch_op:
+        batch_op.alter_column("data", existing_type=sqlmodel.AutoString(), nullable=False)
+        batch_op.drop_index("ix_barcodecache_fetched_at")
+        batch_op.drop_index("ix_barcodecache_brand")
+        batch_op.drop_index("ix_barcodecache_name")
+        batch_op.drop_column("fetched_at")
+        batch_op.drop_column("package_quantity")
+        batch_op.drop_column("brand")
+        batch_op.drop_column("name")
@@ -0,0 +1,38 @@
+"""index hot query paths
+
+Revision ID: e117cab038fb
+Revises: 335e9d33f163
+Create Date: 2026-10-18 16:32:25.622998
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e117cab038fb'
+down_revision: Union[str, None] = '335e9d33f163'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = {
+    "ix_article_storage_id_expiration_date": ("article", ["storage_id", "expiration_date"]),
+    "ix_article_expiration_date": ("article", ["expiration_date"]),
+    "ix_userstorage_user_id_storage_id": ("userstorage", ["user_id", "storage_id"]),
+    "ix_userstorage_storage_id": ("userstorage", ["storage_id"]),
+    "ix_storage_name": ("storage", ["name"]),
+}
+
+
+def upgrade() -> None:
+    for index_name, (table_name, columns) in INDEXES.items():
+        op.create_index(index_name, table_name, columns)
+
+
+def downgrade() -> None:
+    for index_name, (table_name, _) in reversed(INDEXES.items()):
+        op.drop_index(index_name, table_name=table_name)
@@ -0,0 +1,31 @@
+"""user inventory version
+
+Revision ID: 123b73e37b52
+Revises: e117cab038fb
+Create Date: 2026-10-18 16:55:23.449124
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '123b73e37b52'
+down_revision: Union[str, None] = 'e117cab038fb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "user",
+        sa.Column("inventory_version", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.drop_column("inventory_version")
@@ -0,0 +1,31 @@
+"""storage version
+
+Revision ID: 7785a8c157d9
+Revises: 123b73e37b52
+Create Date: 2026-10-18 16:57:50.420216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7785a8c157d9'
+down_revision: Union[str, None] = '123b73e37b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "storage",
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("storage") as batch_op:
+        batch_op.drop_column("version")
@@ -0,0 +1,41 @@
+"""mail outbox
+
+Revision ID: 9b28e990efc4
+Revises: 7785a8c157d9
+Create Date: 2026-10-18 17:06:02.842953
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b28e990efc4'
+down_revision: Union[str, None] = '7785a8c157d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "mailoutbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("message", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("sent_at", sa.DateTime(), nullable=True),
+        sa.Column("last_error", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_mailoutbox_next_attempt_at"), "mailoutbox", ["next_attempt_at"], unique=False)
+    op.create_index(op.f("ix_mailoutbox_sent_at"), "mailoutbox", ["sent_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_mailoutbox_sent_at"), table_name="mailoutbox")
+    op.drop_index(op.f("ix_mailoutbox_next_attempt_at"), table_name="mailoutbox")
+    op.drop_table("mailoutbox")
@@ -0,0 +1,53 @@
+"""cascade storage deletes
+
+Revision ID: abcc7fe6ffa2
+Revises: 9b28e990efc4
+Create Date: 2026-10-18 17:10:48.786153
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'abcc7fe6ffa2'
+down_revision: Union[str, None] = '9b28e990efc4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# SQLite keeps these foreign keys unnamed, the convention names them like PostgreSQL does
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+FOREIGN_KEYS = {
+    "article": [("storage_id", "storage")],
+    "userstorage": [("user_id", "user"), ("storage_id", "storage")],
+}
+
+
+def replace_foreign_keys(ondelete: Union[str, None]) -> None:
+    for table, foreign_keys in FOREIGN_KEYS.items():
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referent in foreign_keys:
+                name = f"{table}_{column}_fkey"
+                batch_op.drop_constraint(name, type_="foreignkey")
+                batch_op.create_foreign_key(name, referent, [column], ["id"], ondelete=ondelete)
+
+
+def delete_orphans() -> None:
+    """Rows left behind by deletes before the cascade, a storage reusing the id would show them again."""
+    op.execute("DELETE FROM article WHERE storage_id NOT IN (SELECT id FROM storage)")
+    op.execute(
+        'DELETE FROM userstorage WHERE storage_id NOT IN (SELECT id FROM storage) OR user_id NOT IN (SELECT id FROM "user")'
+    )
+
+
+def upgrade() -> None:
+    delete_orphans()
+    replace_foreign_keys("CASCADE")
+
+
+def downgrade() -> None:
+    replace_foreign_keys(None)
@@ -0,0 +1,37 @@
+"""cascade user registration deletes
+
+Revision ID: f2e3289fed5c
+Revises: abcc7fe6ffa2
+Create Date: 2026-10-18 17:17:54.013969
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2e3289fed5c'
+down_revision: Union[str, None] = 'abcc7fe6ffa2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# SQLite keeps the foreign key unnamed, the convention names it like PostgreSQL does
+NAMING_CONVENTION = {"fk": "%(table_name)s_%(column_0_name)s_fkey"}
+
+
+def replace_foreign_key(ondelete: Union[str, None]) -> None:
+    with op.batch_alter_table("userregistration", naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint("userregistration_user_id_fkey", type_="foreignkey")
+        batch_op.create_foreign_key("userregistration_user_id_fkey", "user", ["user_id"], ["id"], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    replace_foreign_key("CASCADE")
+
+
+def downgrade() -> None:
+    replace_foreign_key(None)
@@ -0,0 +1,28 @@
+"""user last digest date
+
+Revision ID: d7d3cc0eb967
+Revises: f2e3289fed5c
+Create Date: 2026-10-18 17:36:28.264280
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7d3cc0eb967'
+down_revision: Union[str, None] = 'f2e3289fed5c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("user", sa.Column("last_digest_date", sa.Date(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.drop_column("last_digest_date")
@@ -2,6 +2,7 @@ import asyncio
 import os
 import random
 import string
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Annotated, Dict, Optional
 from uuid import UUID
@@ -17,15 +18,42 @@ from sqlalchemy import JSON, Column, Integer, String, create_engine, or_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.cache import TTLCache
+from app.models import User, scope_owned_storages
+from app.utility import ALGORITHM, JWT_KEY, create_access_token, get_async_db, get_read_db
+
+# verified token -> {"id", "name", "is_activated"}, saves the user query on every request.
+# invalidate_principals only reaches the cache of the current process: with several workers a deleted,
+# deactivated or renamed user stays valid on the others for up to PRINCIPAL_CACHE_TTL seconds, keep it short there.
+principal_cache = TTLCache(
+    maxsize=int(os.environ.get("PRINCIPAL_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("PRINCIPAL_CACHE_TTL", 300)),
+)
+
+
+def invalidate_principals(user_id: Optional[int] = None, name: Optional[str] = None):
+    """Forget cached principals of a user, call after changing or removing it."""
+    principal_cache.discard(
+        lambda principal: principal["id"] == user_id or principal["name"] == name
+    )
+
 
-from app.models import User
-from app.utility import ALGORITHM, JWT_KEY, create_access_token, get_db
+# bcrypt work factor, raising it rehashes stored passwords on their next login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+# bcrypt releases the GIL, a small dedicated pool keeps hashing off the event loop
+# without letting a burst of logins take every core
+password_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("PASSWORD_HASH_WORKERS", 2)),
+    thread_name_prefix="bcrypt",
+)
 
 
 # Hash a password using bcrypt
 def hash_password(password: str):
     pwd_bytes = password.encode()
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password=pwd_bytes, salt=salt)
     return hashed_password.decode()
 
@@ -38,6 +66,23 @@ def verify_password(plain_password: str, hashed_password: str):
     )
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    # "$2b$12$..." -> 12
+    return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(
+        password_executor, hash_password, password
+    )
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(
+        password_executor, verify_password, plain_password, hashed_password
+    )
+
+
 
 
 class UserResponse(BaseModel):
@@ -112,8 +157,22 @@ def authenticate_user(name: str, password: str,session:Session) -> User | bool:
     return False
 
 
+async def get_user_async(name: str, session: AsyncSession) -> User | None:
+    return (await session.exec(select(User).where(User.name == name))).first()
+
+
+async def authenticate_user_async(name: str, password: str,session:AsyncSession) -> User | bool:
+    if user := await get_user_async(name,session):
+        return user if await verify_password_async(password, user.password_hash) else False
+    return False
+
+
 
-async def get_current_user(token: str = Depends(oauth2_scheme),db:Session=Depends(get_db)) -> User:
+async def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+    read_db: AsyncSession = Depends(get_read_db),
+) -> User:
     if token is None:
         return None
     credentials_exception = HTTPException(
@@ -121,22 +180,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme),db:Session=Depend
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    name: str = ""
-    try:
-        if token.startswith("Bearer "):
-            token = token.split("Bearer ")[1]
-        payload = jwt.decode(token, JWT_KEY, algorithms=[ALGORITHM])
-        name: str = payload.get("sub")  # type: ignore
-        if name is None:
+    if token.startswith("Bearer "):
+        token = token.split("Bearer ")[1]
+    if (principal := principal_cache.get(token)) is None:
+        try:
+            payload = jwt.decode(token, JWT_KEY, algorithms=[ALGORITHM])
+            name: str = payload.get("sub")  # type: ignore
+            if name is None:
+                raise NotAuthenticatedException
+        except JWTError as e:
+            print("JWTError", e)
+            raise credentials_exception from e
+        db_user = await get_user_async(name,db)  # type: ignore
+        if db_user is None:
             raise NotAuthenticatedException
-    except JWTError as e:
-        print("JWTError", e)
-        raise credentials_exception from e
-    user = get_user(name,db)  # type: ignore
-    if user is None:
-        raise NotAuthenticatedException
-    if not user.is_activated:
+        principal = {"id": db_user.id, "name": db_user.name, "is_activated": db_user.is_activated}
+        # never serve a token from cache after it expired
+        ttl = principal_cache.ttl
+        if "exp" in payload:
+            ttl = min(ttl, payload["exp"] - datetime.now(timezone.utc).timestamp())
+        principal_cache.set(token, principal, ttl=ttl)
+    if not principal["is_activated"]:
         raise ValueError("User not activated")
+    # detached user holding only the principal fields, handlers use id and name
+    user = User(**principal)
+    # both request sessions, dependencies are cached per request so the views get these same sessions
+    scope_owned_storages(db, user.id)
+    scope_owned_storages(read_db, user.id)
     return user
 
 
@@ -144,9 +214,9 @@ async def get_current_user(token: str = Depends(oauth2_scheme),db:Session=Depend
     "/token", response_model=UserResponse, tags=["auth"], description="coming soon"
 )
 async def login_for_access_token(
-    request: Request, form_data: OAuth2PasswordRequestForm = Depends(),db:Session=Depends(get_db)
+    request: Request, form_data: OAuth2PasswordRequestForm = Depends(),db:AsyncSession=Depends(get_async_db)
 ):
-    user = authenticate_user(form_data.username, form_data.password,db)
+    user = await authenticate_user_async(form_data.username, form_data.password,db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -166,9 +236,9 @@ async def login_for_access_token(
 
 
 @app.post("/create_user", tags=["auth"], description="coming soon")
-async def create_user(request: Request, user: UserRequest, session: Session = Depends(get_db)):
-    hashed_password = get_password_hash(user.password)
-    existing = session.exec(select(User)).all()
+async def create_user(request: Request, user: UserRequest, session: AsyncSession = Depends(get_async_db)):
+    hashed_password = await hash_password_async(user.password)
+    existing = (await session.exec(select(User))).all()
     if existing_user := next((x for x in existing if user.name == x.name), False):
         return {
             "success": False,
@@ -181,6 +251,6 @@ async def create_user(request: Request, user: UserRequest, session: Session = De
         settings={},
     )
     session.add(db_login)
-    session.commit()
-    session.refresh(db_login)
+    await session.commit()
+    await session.refresh(db_login)
     return {"success": True, "message": "User created", "login_id": db_login.id}
@@ -1,26 +1,209 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Iterable, Optional
+
 import openfoodfacts
+import requests
+from openfoodfacts.api import send_get_request
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
+from app.cache import TTLCache
 from app.models import BarCodeCache
 
 api = openfoodfacts.API(user_agent="BeforeYouGo/0.1")
+if os.environ.get("OPENFOODFACTS_URL"):
+    api.product.base_url = os.environ["OPENFOODFACTS_URL"].rstrip("/")
+
+PRODUCT_FIELDS = ["product_name", "quantity", "brands"]
+SEARCH_PAGE_SIZE = 100
+
+# in-process tier in front of the BarCodeCache table, None marks unknown barcodes
+barcode_cache = TTLCache(
+    maxsize=int(os.environ.get("BARCODE_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("BARCODE_CACHE_TTL", 24 * 3600)),
+)
+NEGATIVE_TTL = float(os.environ.get("BARCODE_CACHE_NEGATIVE_TTL", 3600))
+_MISSING = object()
+
+# barcode -> running remote lookup, shared by all concurrent requests for it
+_in_flight: dict[str, asyncio.Future] = {}
+
+
+def product_fields(data: dict) -> dict:
+    """Map an OpenFoodFacts product to the BarCodeCache columns."""
+    return {
+        "name": data.get("product_name") or "-",
+        "brand": data.get("brands") or None,
+        "package_quantity": data.get("quantity") or None,
+    }
+
+
+def product_from_api(barcode: str, data: dict) -> BarCodeCache:
+    return BarCodeCache(barcode=barcode, fetched_at=datetime.today(), **product_fields(data))
+
 
+def remember(barcode: str, product: Optional[BarCodeCache]):
+    if product is None:
+        barcode_cache.set(barcode, None, ttl=NEGATIVE_TTL)
+    else:
+        # keep a detached copy, the session expires its instances on commit
+        barcode_cache.set(barcode, BarCodeCache(**product.model_dump()))
 
-def lookup_data(session: Session, barcode: str):
-    if cache := session.exec(
-        select(BarCodeCache).where(BarCodeCache.barcode == barcode)
-    ).first():
-        return cache.data
-    # Call external API
+
+def cached_products(
+    session: Session, barcodes: Iterable[str]
+) -> tuple[dict[str, Optional[BarCodeCache]], list[str]]:
+    """Resolve barcodes from memory and then with one IN query, return the hits and the misses."""
+    found = {}
+    unresolved = []
+    for barcode in dict.fromkeys(barcodes):
+        if (product := barcode_cache.get(barcode, _MISSING)) is _MISSING:
+            unresolved.append(barcode)
+        else:
+            found[barcode] = product
+    if not unresolved:
+        return found, []
+    for product in session.exec(
+        select(BarCodeCache).where(BarCodeCache.barcode.in_(unresolved))
+    ).all():
+        remember(product.barcode, product)
+        found[product.barcode] = product
+    return found, [barcode for barcode in unresolved if barcode not in found]
+
+
+def cached_product(session: Session, barcode: str) -> Optional[BarCodeCache] | object:
+    found, _ = cached_products(session, [barcode])
+    return found.get(barcode, _MISSING)
+
+
+def fetch_product(barcode: str) -> Optional[BarCodeCache]:
+    """Blocking call to OpenFoodFacts, returns None for unknown products.
+
+    Raises requests.RequestException if the API could not be reached.
+    """
     try:
-        if data := api.product.get(
-            code=barcode, fields=["product_name", "quantity", "brands"]
-        ):
-            data_str = f'{data.get("product_name","-")} ({data.get("brands","-")}) - {data.get("quantity","-")}'
-            session.add(BarCodeCache(barcode=barcode, data=data_str))
-            session.commit()
-            return data_str
+        if data := api.product.get(code=barcode, fields=PRODUCT_FIELDS):
+            return product_from_api(barcode, data)
     except ValueError as e:
         print(e)
-    return ""
+    return None
+
+
+def fetch_products(barcodes: list[str]) -> dict[str, BarCodeCache]:
+    """Blocking batched search on OpenFoodFacts, unknown barcodes are left out.
+
+    Raises requests.RequestException if the API could not be reached.
+    """
+    products = {}
+    for start in range(0, len(barcodes), SEARCH_PAGE_SIZE):
+        chunk = barcodes[start : start + SEARCH_PAGE_SIZE]
+        # the server does not understand escaped commas, so the query is built by hand
+        url = (
+            f"{api.product.base_url}/api/v2/search?code={','.join(chunk)}"
+            f"&fields=code,{','.join(PRODUCT_FIELDS)}&page_size={len(chunk)}"
+        )
+        response = send_get_request(url=url, api_config=api.api_config) or {}
+        for data in response.get("products", []):
+            if data.get("code") in chunk:
+                products[data["code"]] = product_from_api(data["code"], data)
+    return products
+
+
+def upsert_statement(dialect_name: str):
+    """INSERT into BarCodeCache that refreshes rows whose barcode is already stored."""
+    insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+    statement = insert(BarCodeCache)
+    return statement.on_conflict_do_update(
+        index_elements=[BarCodeCache.barcode],
+        set_={
+            column: statement.excluded[column]
+            for column in ("name", "brand", "package_quantity", "fetched_at")
+        },
+    )
+
+
+def store_products(
+    session: Session, barcodes: list[str], products: dict[str, BarCodeCache]
+):
+    for barcode in barcodes:
+        remember(barcode, products.get(barcode))
+    if products:
+        # upsert, another worker may have stored the same barcode since our cache lookup
+        session.exec(
+            upsert_statement(session.get_bind().dialect.name),
+            params=[product.model_dump() for product in products.values()],
+        )
+        session.commit()
+
+
+def lookup_product(session: Session, barcode: str) -> Optional[BarCodeCache]:
+    if (product := cached_product(session, barcode)) is not _MISSING:
+        return product
+    try:
+        product = fetch_product(barcode)
+    except requests.RequestException as e:
+        print(e)
+        return None
+    store_products(session, [barcode], {barcode: product} if product else {})
+    return product
+
+
+def lookup_data(session: Session, barcode: str) -> str:
+    product = lookup_product(session, barcode)
+    return product.display_name if product else ""
+
+
+def lookup_many(session: Session, barcodes: Iterable[str]) -> dict[str, BarCodeCache]:
+    """Resolve many barcodes with one IN query and one batched remote fetch for the misses."""
+    found, missing = cached_products(session, barcodes)
+    if missing:
+        try:
+            fetched = fetch_products(missing)
+        except requests.RequestException as e:
+            print(e)
+        else:
+            store_products(session, missing, fetched)
+            found |= fetched
+    return {barcode: product for barcode, product in found.items() if product}
+
+
+async def fetch_product_async(barcode: str) -> Optional[BarCodeCache]:
+    """Run fetch_product in a worker thread, coalescing concurrent calls per barcode."""
+    if (future := _in_flight.get(barcode)) is None:
+        future = asyncio.ensure_future(asyncio.to_thread(fetch_product, barcode))
+        _in_flight[barcode] = future
+        future.add_done_callback(lambda _: _in_flight.pop(barcode, None))
+    # shield so a disconnecting client does not cancel the lookup for the others
+    return await asyncio.shield(future)
+
+
+async def lookup_data_async(session: AsyncSession, barcode: str) -> str:
+    if (product := await session.run_sync(cached_product, barcode)) is _MISSING:
+        try:
+            product = await fetch_product_async(barcode)
+        except requests.RequestException as e:
+            print(e)
+            return ""
+        # a coalesced request may already have stored the same barcode, peek so the stats count one miss
+        if barcode_cache.peek(barcode, _MISSING) is _MISSING:
+            await session.run_sync(store_products, [barcode], {barcode: product} if product else {})
+    return product.display_name if product else ""
+
 
+async def lookup_many_async(
+    session: AsyncSession, barcodes: Iterable[str]
+) -> dict[str, BarCodeCache]:
+    found, missing = await session.run_sync(cached_products, list(barcodes))
+    if missing:
+        try:
+            fetched = await asyncio.to_thread(fetch_products, missing)
+        except requests.RequestException as e:
+            print(e)
+        else:
+            await session.run_sync(store_products, missing, fetched)
+            found |= fetched
+    return {barcode: product for barcode, product in found.items() if product}
@@ -1,9 +1,12 @@
-from datetime import date
-from typing import Optional
+import json
+from datetime import date, datetime
+from typing import Iterator, Optional
 
-from sqlmodel import Session, select
+from sqlalchemy import delete, func, or_, tuple_, update
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, insert, select
 
-from app.models import Article
+from app.models import Article, Storage, UserStorage, bump_inventory_version
 from app.validators import valid_article, valid_storage
 
 
@@ -23,11 +26,41 @@ def article_create(
         name=name, storage_id=storage.id, price=price, expiration_date=expiration_date, quantity=quantity
     )
     session.add(article)
+    bump_inventory_version(session, [storage.id])
     session.commit()
     session.refresh(article)
     return article
 
 
+def article_create_many(session: Session, user_id: int, entries: list[dict]) -> int:
+    """Insert many articles with one bulk INSERT and one commit.
+
+    Every entry needs name, storage_id_or_name and expiration_date, quantity and price are optional.
+    """
+    storages = {}
+    for storage_id_or_name in {entry["storage_id_or_name"] for entry in entries}:
+        if not (storage := valid_storage(session, storage_id_or_name, user_id)):
+            raise ValueError(f"Invalid storage {storage_id_or_name}")
+        storages[storage_id_or_name] = storage.id
+    insertion_date = datetime.today()
+    articles = [
+        {
+            "name": entry["name"],
+            "storage_id": storages[entry["storage_id_or_name"]],
+            "expiration_date": entry["expiration_date"],
+            "quantity": entry.get("quantity") or 1,
+            "price": entry.get("price"),
+            "insertion_date": insertion_date,
+        }
+        for entry in entries
+    ]
+    if articles:
+        session.exec(insert(Article), params=articles)
+        bump_inventory_version(session, set(storages.values()))
+        session.commit()
+    return len(articles)
+
+
 def article_list(session: Session, user_id: int, storage_id_or_name: str | int):
     if storage := valid_storage(session, storage_id_or_name, user_id):
         return session.exec(
@@ -36,18 +69,256 @@ def article_list(session: Session, user_id: int, storage_id_or_name: str | int):
     raise ValueError("Invalid storage")
 
 
+def articles_by_storage(storages: list[Storage], articles: list[Article]) -> dict[int, list[Article]]:
+    """Group articles per storage id in one pass, sorted by expiration date, every storage gets a list."""
+    grouped = {storage.id: [] for storage in storages}
+    for article in sorted(articles, key=lambda article: article.expiration_date):
+        grouped.setdefault(article.storage_id, []).append(article)
+    return grouped
+
+
+ARTICLE_PAGE_LENGTH = 10
+# rows fetched per round trip when a whole inventory is streamed
+ARTICLE_STREAM_BATCH = 200
+# sortable columns of the article tables, quantity was nullable in old rows
+ARTICLE_ORDER_COLUMNS = {
+    "quantity": func.coalesce(Article.quantity, 1),
+    "name": Article.name,
+    "storage": Storage.name,
+    "expiration_date": Article.expiration_date,
+}
+
+
+def article_cursor(article: Article, storage_name: str, order: str) -> list:
+    """Sort key of the last row of a page, the next page continues after it."""
+    value = {
+        "quantity": article.quantity or 1,
+        "name": article.name,
+        "storage": storage_name,
+        "expiration_date": article.expiration_date.isoformat(),
+    }[order]
+    return [value, article.id]
+
+
+def parse_article_cursor(cursor: str, order: str) -> Optional[list]:
+    """A cursor sent back by the client, None if it is malformed or was not made for order."""
+    try:
+        value, article_id = json.loads(cursor)
+    except (ValueError, TypeError):
+        return None
+    if type(article_id) is not int:
+        return None
+    if order == "quantity":
+        valid = type(value) is int
+    elif order == "expiration_date":
+        try:
+            valid = bool(datetime.fromisoformat(value))
+        except (ValueError, TypeError):
+            valid = False
+    else:
+        valid = isinstance(value, str)
+    return [value, article_id] if valid else None
+
+
+def article_page(
+    session: Session,
+    user_id: int,
+    storage_id: Optional[int] = None,
+    search: str = "",
+    order: str = "expiration_date",
+    descending: bool = False,
+    start: int = 0,
+    length: int = ARTICLE_PAGE_LENGTH,
+    after: Optional[list] = None,
+) -> tuple[int, int, list[tuple[Article, str]]]:
+    """One page of the user's articles with their storage name, plus the total and filtered counts.
+
+    With after (a cursor from article_cursor) the page is read by keyset from that row instead of by OFFSET.
+    """
+    query = (
+        select(Article, Storage.name)
+        .join(Storage, Storage.id == Article.storage_id)
+        .join(UserStorage, UserStorage.storage_id == Article.storage_id)
+        .where(UserStorage.user_id == user_id)
+    )
+    if storage_id is not None:
+        query = query.where(Article.storage_id == storage_id)
+    total = session.exec(select(func.count()).select_from(query.subquery())).one()
+    if search:
+        query = query.where(or_(Article.name.ilike(f"%{search}%"), Storage.name.ilike(f"%{search}%")))
+        filtered = session.exec(select(func.count()).select_from(query.subquery())).one()
+    else:
+        filtered = total
+
+    column = ARTICLE_ORDER_COLUMNS[order]
+    if after is not None:
+        value, article_id = after
+        if order == "expiration_date":
+            value = datetime.fromisoformat(value)
+        key = tuple_(column, Article.id)
+        query = query.where(key < tuple_(value, article_id) if descending else key > tuple_(value, article_id))
+    else:
+        query = query.offset(start)
+    if descending:
+        query = query.order_by(column.desc(), Article.id.desc())
+    else:
+        query = query.order_by(column, Article.id)
+    return total, filtered, session.exec(query.limit(length)).all()
+
+
+def article_rows(session: Session, user_id: int, yield_per: int = ARTICLE_STREAM_BATCH) -> Iterator[Article]:
+    """All of the user's articles by expiration, fetched yield_per rows at a time while they are consumed."""
+    query = (
+        select(Article)
+        .join(UserStorage, UserStorage.storage_id == Article.storage_id)
+        .where(UserStorage.user_id == user_id)
+        .order_by(Article.expiration_date, Article.id)
+        .execution_options(yield_per=yield_per)
+    )
+    yield from session.exec(query)
+
+
+def article_first_pages(
+    session: Session,
+    user_id: int,
+    length: int = ARTICLE_PAGE_LENGTH,
+    storage_ids: Optional[list[int]] = None,
+) -> tuple[list[Article], dict[int, int]]:
+    """The first page (by expiration date) of every storage of the user in one query, and the article count per storage.
+
+    storage_ids limits both to these storages.
+    """
+    owned = UserStorage.user_id == user_id
+    if storage_ids is not None:
+        owned &= Article.storage_id.in_(storage_ids)
+    ranked = (
+        select(
+            Article,
+            func.row_number()
+            .over(partition_by=Article.storage_id, order_by=(Article.expiration_date, Article.id))
+            .label("rank"),
+        )
+        .join(UserStorage, UserStorage.storage_id == Article.storage_id)
+        .where(owned)
+        .subquery()
+    )
+    ranked_article = aliased(Article, ranked)
+    articles = session.exec(select(ranked_article).where(ranked.c.rank <= length)).all()
+    counts = session.exec(
+        select(Article.storage_id, func.count())
+        .join(UserStorage, UserStorage.storage_id == Article.storage_id)
+        .where(owned)
+        .group_by(Article.storage_id)
+    ).all()
+    return articles, dict(counts)
+
+
 def article_delete(session: Session, user_id: int, article_id: int):
-    article = session.exec(select(Article).where(Article.id == article_id)).first()
+    article = valid_article(session, article_id, user_id)
     if not article:
         raise ValueError("Invalid article")
-    storage = valid_storage(session, article.storage_id, user_id)
-    if not storage:
-        raise ValueError("Invalid storage")
     session.delete(article)
+    bump_inventory_version(session, [article.storage_id])
     session.commit()
     return article
 
 
+def owned_articles(user_id: int, article_ids: list[int]):
+    """Condition matching the given articles that are in one of the user's storages."""
+    return Article.id.in_(article_ids) & Article.storage_id.in_(
+        select(UserStorage.storage_id).where(UserStorage.user_id == user_id)
+    )
+
+
+def article_consume(
+    session: Session, user_id: int, article_id: int, units: int = 1
+) -> Optional[tuple[int, int]]:
+    """Take units of an article with one conditional UPDATE ... RETURNING, no units are lost to concurrent calls.
+
+    The article is deleted in the same transaction once none are left. Returns the remaining quantity and the
+    storage id, or None when the article is not in one of the user's storages.
+    """
+    row = session.exec(
+        update(Article)
+        .where(owned_articles(user_id, [article_id]))
+        .values(quantity=func.coalesce(Article.quantity, 1) - units)
+        .returning(Article.quantity, Article.storage_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return None
+    quantity, storage_id = row
+    if quantity < 1:
+        session.exec(delete(Article).where(Article.id == article_id, Article.quantity < 1))
+    bump_inventory_version(session, [storage_id])
+    session.commit()
+    return max(quantity, 0), storage_id
+
+
+def article_move_many(session: Session, user_id: int, article_ids: list[int], storage_id: int) -> int:
+    """Move the user's articles into one of their storages with one UPDATE, returns the number moved."""
+    if not valid_storage(session, storage_id, user_id):
+        raise ValueError("Invalid storage")
+    source_ids = session.exec(select(Article.storage_id).where(owned_articles(user_id, article_ids)).distinct()).all()
+    moved = session.exec(
+        update(Article)
+        .where(owned_articles(user_id, article_ids))
+        .values(storage_id=storage_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    bump_inventory_version(session, [*source_ids, storage_id])
+    session.commit()
+    return moved
+
+
+def article_delete_many(session: Session, user_id: int, article_ids: list[int]) -> int:
+    storage_ids = session.exec(
+        delete(Article)
+        .where(owned_articles(user_id, article_ids))
+        .returning(Article.storage_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    bump_inventory_version(session, set(storage_ids))
+    session.commit()
+    return len(storage_ids)
+
+
+def shifted_expiration(dialect_name: str, days: int):
+    """Article.expiration_date moved by days, date arithmetic differs between the backends."""
+    if dialect_name == "postgresql":
+        return Article.expiration_date + func.make_interval(0, 0, 0, days)
+    return func.datetime(Article.expiration_date, f"{days:+d} days")
+
+
+def article_shift_expiration_many(session: Session, user_id: int, article_ids: list[int], days: int) -> int:
+    """Move the expiration date of every given article by days, each keeps its distance to the others."""
+    storage_ids = session.exec(
+        update(Article)
+        .where(owned_articles(user_id, article_ids))
+        .values(expiration_date=shifted_expiration(session.get_bind().dialect.name, days))
+        .returning(Article.storage_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    bump_inventory_version(session, set(storage_ids))
+    session.commit()
+    return len(storage_ids)
+
+
+def article_consume_many(session: Session, user_id: int, article_ids: list[int], units: int = 1) -> int:
+    """Take units of every given article like article_consume, articles without units left are deleted."""
+    storage_ids = session.exec(
+        update(Article)
+        .where(owned_articles(user_id, article_ids))
+        .values(quantity=func.coalesce(Article.quantity, 1) - units)
+        .returning(Article.storage_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    session.exec(delete(Article).where(owned_articles(user_id, article_ids), Article.quantity < 1))
+    bump_inventory_version(session, set(storage_ids))
+    session.commit()
+    return len(storage_ids)
+
+
 def article_update(
     session: Session,
     user_id: int,
@@ -61,6 +332,7 @@ def article_update(
     article = valid_article(session, article_id, user_id)
     if not article:
         raise ValueError("Invalid article")
+    storage_ids = {article.storage_id}
     if storage := valid_storage(session, storage_id_or_name, user_id):
         article.storage_id = storage.id
     if name:
@@ -71,6 +343,7 @@ def article_update(
         article.price = price
     if quantity:
         article.quantity = quantity
+    bump_inventory_version(session, storage_ids | {article.storage_id})
     session.commit()
     session.refresh(article)
     return article
@@ -1,6 +1,6 @@
-from sqlmodel import Session, select, delete
+from sqlmodel import Session, func, select, delete
 
-from app.models import Storage, UserStorage
+from app.models import Article, Storage, UserStorage, bump_inventory_version, owned_storages, reset_owned_storages
 from app.validators import valid_storage
 
 
@@ -10,24 +10,43 @@ def storage_create(session: Session, user_id: int, name: str):
     session.commit()
     session.refresh(storage)
     session.add(UserStorage(user_id=user_id, storage_id=storage.id))
+    bump_inventory_version(session, user_ids=[user_id])
     session.commit()
+    reset_owned_storages(session, user_id)
     session.refresh(storage)
     return storage
 
 
 def storage_list(session: Session, user_id: int):
+    if (storages := owned_storages(session, user_id)) is not None:
+        return list(storages.values())
     return session.exec(
         select(Storage).join(UserStorage).where(UserStorage.user_id == user_id)
     ).all()
 
 
-def storage_delete(session: Session, user_id: int, storage_id: int):
+def storage_article_count(session: Session, storage_id: int) -> int:
+    # answered from the (storage_id, expiration_date) index, no article is loaded
+    return session.exec(select(func.count()).where(Article.storage_id == storage_id)).one()
+
+
+def storage_delete(session: Session, user_id: int, storage_id: int, with_articles: bool = False):
+    """Delete a storage and its links, with_articles also deletes its articles, all in one transaction.
+
+    Without with_articles only empty storages are deleted.
+    """
     storage = valid_storage(session, storage_id, user_id)
     if not storage:
         raise ValueError("Invalid storage")
+    if with_articles:
+        session.exec(delete(Article).where(Article.storage_id == storage.id))
+    elif count := storage_article_count(session, storage.id):
+        raise ValueError(f"Storage not empty, {count} entries in Storage")
+    bump_inventory_version(session, [storage.id])
     session.exec(delete(UserStorage).where(UserStorage.storage_id == storage.id))
-    session.delete(storage)
+    session.exec(delete(Storage).where(Storage.id == storage.id))
     session.commit()
+    reset_owned_storages(session, user_id)
     print("Deleted", storage)
     return storage
 
@@ -37,6 +56,7 @@ def storage_update(session: Session, user_id: int, storage_id: int, name: str):
     if not storage:
         raise ValueError("Invalid storage")
     storage.name = name
+    bump_inventory_version(session, [storage.id])
     session.commit()
     session.refresh(storage)
     return storage
@@ -1,11 +1,35 @@
-import bcrypt
-from sqlmodel import Session, select
+import os
+import secrets
+from typing import Optional
 
-from app.mail_sending import has_api_key, send_registration_mail
-from app.models import User, UserRegistration
+from sqlmodel import Session, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.auth import (
+    hash_password,
+    hash_password_async,
+    invalidate_principals,
+    needs_rehash,
+    verify_password,
+    verify_password_async,
+)
+from app.mail_sending import mail_enabled, registration_mail
+from app.models import User, UserRegistration, UserStorage
+from app.outbox import queue_mail
 from app.validators import validate_new_user_name
 
 
+def create_admin(session: Session) -> Optional[User]:
+    """The first account of an installation without signup, created by the migrate step."""
+    if os.environ.get("enable_signup") or session.exec(select(User)).first() is not None:
+        return None
+    return user_create(session, "admin", os.environ.get("admin_password", "not_a_save_password"), "a@b.com")
+
+
+def registration_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
 def user_create(
     session: Session,
     name: str,
@@ -14,18 +38,38 @@ def user_create(
     with_registration: bool = False,
 ):
     validate_new_user_name(session, name)
-    password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode(
-        "utf-8"
-    )
+    return _user_insert(session, name, hash_password(password), email, with_registration)
+
+
+async def user_create_async(
+    session: AsyncSession,
+    name: str,
+    password: str,
+    email: str,
+    with_registration: bool = False,
+):
+    await session.run_sync(validate_new_user_name, name)
+    password_hash = await hash_password_async(password)
+    return await session.run_sync(_user_insert, name, password_hash, email, with_registration)
+
+
+def _user_insert(
+    session: Session,
+    name: str,
+    password_hash: str,
+    email: str,
+    with_registration: bool,
+):
+    invalidate_principals(name=name)
     user = User(name=name, password_hash=password_hash, email=email)
     session.add(user)
     session.commit()
     session.refresh(user)
-    if with_registration and has_api_key:
-        token = bcrypt.hashpw(name.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    if with_registration and mail_enabled():
+        token = registration_token()
         session.add(UserRegistration(token=token, user_id=user.id))
+        queue_mail(session, registration_mail(user.email, token))
         session.commit()
-        send_registration_mail(user.email, token)
         return user
     user.is_activated = True
     session.commit()
@@ -41,8 +85,12 @@ def user_delete(session: Session, user_id: int):
     user = session.exec(select(User).where(User.id == user_id)).first()
     if not user:
         raise ValueError("Invalid user")
+    # the foreign keys cascade, the explicit deletes also cover databases before that migration
+    session.exec(delete(UserRegistration).where(UserRegistration.user_id == user_id))
+    session.exec(delete(UserStorage).where(UserStorage.user_id == user_id))
     session.delete(user)
     session.commit()
+    invalidate_principals(user_id=user_id)
     return user
 
 
@@ -59,12 +107,11 @@ def user_update(
     if name:
         user.name = name
     if password:
-        user.password_hash = bcrypt.hashpw(
-            password.encode("utf-8"), bcrypt.gensalt()
-        ).decode("utf-8")
+        user.password_hash = hash_password(password)
     if email:
         user.email = email
     session.commit()
+    invalidate_principals(user_id=user_id)
     session.refresh(user)
     return user
 
@@ -84,11 +131,12 @@ def user_activate(session: Session, token: str):
         raise ValueError("Invalid user")
     user.is_activated = True
     session.commit()
+    invalidate_principals(user_id=user.id)
     session.refresh(user)
     return user
 
 
-def user_login(session: Session, name: str, password: str):
+def _login_candidate(session: Session, name: str) -> User:
     user = session.exec(select(User).where(User.name == name)).first()
     if not user:
         raise ValueError("Invalid user")
@@ -96,11 +144,32 @@ def user_login(session: Session, name: str, password: str):
         registration = session.exec(
             select(UserRegistration).where(UserRegistration.user_id == user.id)
         ).first() or UserRegistration(
-            token=bcrypt.hashpw(name.encode("utf-8"), bcrypt.gensalt()).decode("utf-8"),
+            token=registration_token(),
             user_id=user.id,
         )
-        send_registration_mail(user.email, registration.token)
+        if mail_enabled():
+            session.add(registration)
+            queue_mail(session, registration_mail(user.email, registration.token))
+            session.commit()
         raise ValueError("User not activated yet, please check your email")
-    if bcrypt.checkpw(password.encode("utf-8"), user.password_hash.encode("utf-8")):
+    return user
+
+
+def user_login(session: Session, name: str, password: str):
+    user = _login_candidate(session, name)
+    if verify_password(password, user.password_hash):
+        if needs_rehash(user.password_hash):
+            user.password_hash = hash_password(password)
+            session.commit()
+        return user
+    raise ValueError("Invalid password")
+
+
+async def user_login_async(session: AsyncSession, name: str, password: str):
+    user = await session.run_sync(_login_candidate, name)
+    if await verify_password_async(password, user.password_hash):
+        if needs_rehash(user.password_hash):
+            user.password_hash = await hash_password_async(password)
+            await session.commit()
         return user
     raise ValueError("Invalid password")
@@ -0,0 +1,111 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import Session, SQLModel, create_engine
+
+import app.models  # noqa: F401, registers the tables on SQLModel.metadata
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///database/database.db")
+
+# connection settings applied to every new SQLite connection, see https://sqlite.org/pragma.html
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    # negative values are KiB instead of pages
+    "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -64 * 1024)),
+    "foreign_keys": "ON",
+}
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+READ_POOL_SIZE = int(os.environ.get("DATABASE_READ_POOL_SIZE", 10))
+# QueuePool settings for server databases, pool_size is per engine and worker process
+SERVER_POOL_OPTIONS = {
+    "max_overflow": int(os.environ.get("DATABASE_MAX_OVERFLOW", 10)),
+    "pool_timeout": float(os.environ.get("DATABASE_POOL_TIMEOUT", 30)),
+    # connections idle longer than this are replaced, stays below server and proxy idle timeouts
+    "pool_recycle": int(os.environ.get("DATABASE_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": True,
+}
+
+# psycopg 3 links against the libpq of the runtime image and serves sync and asyncio
+DRIVERS = {"postgresql": "postgresql+psycopg", "postgres": "postgresql+psycopg"}
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite"}
+
+
+def database_url(url: str | URL) -> URL:
+    url = make_url(url)
+    if url.drivername in DRIVERS:
+        return url.set(drivername=DRIVERS[url.drivername])
+    return url
+
+
+def async_url(url: str | URL) -> URL:
+    """Swap the driver of a sync database url for its asyncio counterpart."""
+    url = database_url(url)
+    if url.drivername in ASYNC_DRIVERS:
+        return url.set(drivername=ASYNC_DRIVERS[url.drivername])
+    return url
+
+
+def apply_sqlite_pragmas(engine: Engine, read_only: bool = False):
+    pragmas = SQLITE_PRAGMAS | ({"query_only": "ON"} if read_only else {})
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def create_database_engine(
+    url: str | URL = DATABASE_URL, asynchronous: bool = False, read_only: bool = False
+) -> Engine | AsyncEngine:
+    """Engine for url with the connection settings of its backend.
+
+    read_only engines get their own, larger pool and refuse writes, they serve the GET views.
+    """
+    url = async_url(url) if asynchronous else database_url(url)
+    options = {}
+    if url.database and url.database != ":memory:":
+        options["pool_size"] = READ_POOL_SIZE if read_only else POOL_SIZE
+    if url.get_backend_name() == "postgresql":
+        options |= SERVER_POOL_OPTIONS
+        if read_only:
+            options["connect_args"] = {"options": "-c default_transaction_read_only=on"}
+    if asynchronous:
+        engine = create_async_engine(url, **options)
+    else:
+        engine = create_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        apply_sqlite_pragmas(engine.sync_engine if asynchronous else engine, read_only)
+    return engine
+
+
+def migrate():
+    """Bring DATABASE_URL to the latest revision, an empty database gets the current schema and is stamped.
+
+    Runs once before the workers start, so it also creates the admin account of a new installation.
+    """
+    # imported here, app.controller_user reaches this module again through app.utility
+    from app.controller_user import create_admin
+
+    engine = create_database_engine()
+    config = Config("alembic.ini")
+    if inspect(engine).has_table("article"):
+        command.upgrade(config, "head")
+    else:
+        SQLModel.metadata.create_all(engine)
+        command.stamp(config, "head")
+    with Session(engine) as session:
+        create_admin(session)
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    migrate()
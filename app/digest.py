@@ -0,0 +1,139 @@
+"""Daily mail with the articles that expire soon.
+
+digest_worker sends it from the app lifespan, python -m app.digest sends the due digests once.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
+from itertools import groupby
+
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+
+from app.mail_sending import mail_enabled, send_mail
+from app.models import Article, Storage, User, UserStorage
+from app.utility import engine, templates
+
+# articles expiring within this many days after today are listed
+DIGEST_DAYS = int(os.environ.get("DIGEST_DAYS", 3))
+# digests sent at the same time, bounds the concurrent requests to the mail API
+DIGEST_WORKERS = int(os.environ.get("DIGEST_WORKERS", 4))
+# digests go out from this hour on, the worker checks every DIGEST_POLL_SECONDS for users still without one
+DIGEST_HOUR = int(os.environ.get("DIGEST_HOUR", 7))
+DIGEST_POLL_SECONDS = float(os.environ.get("DIGEST_POLL_SECONDS", 3600))
+
+
+def digest_due(as_of: date):
+    return or_(User.last_digest_date.is_(None), User.last_digest_date < as_of)
+
+
+def upcoming_expirations(
+    session: Session, as_of: date, days: int = DIGEST_DAYS
+) -> list[tuple[User, list[tuple[Article, str]]]]:
+    """Articles expiring from as_of to days after it with their storage name, per activated user with an email
+    who has not had the digest of as_of yet.
+
+    One range query over Article.expiration_date, ordered by user so the rows are grouped in a single pass.
+    """
+    start = datetime.combine(as_of, time.min)
+    query = (
+        select(User, Article, Storage.name)
+        .join(UserStorage, UserStorage.user_id == User.id)
+        .join(Article, Article.storage_id == UserStorage.storage_id)
+        .join(Storage, Storage.id == Article.storage_id)
+        .where(Article.expiration_date >= start, Article.expiration_date < start + timedelta(days=days + 1))
+        .where(User.is_activated, User.email != "", digest_due(as_of))
+        .order_by(User.id, Article.expiration_date, Article.id)
+    )
+    return [
+        (user, [(article, storage_name) for _, article, storage_name in rows])
+        for user, rows in groupby(session.exec(query), key=lambda row: row[0])
+    ]
+
+
+def render_digest(user: User, articles: list[tuple[Article, str]], as_of: date) -> dict:
+    """The digest of one user as a message for mail_sending.send_mail."""
+    rows = [(article, storage_name, article.expiry(as_of).days_left) for article, storage_name in articles]
+    text = "\n".join(
+        f"{article.name} ({storage_name}): {article.expiration_date.date()}, {days_left} days left"
+        for article, storage_name, days_left in rows
+    )
+    return {
+        "from": os.environ.get("RESEND_DOMAIN"),
+        "to": user.email,
+        "subject": f"{len(rows)} articles expire soon",
+        "html": templates.get_template("digest_mail.html").render(
+            user=user, rows=rows, base_url=os.environ.get("BASE_URL", "")
+        ),
+        "text": f"These articles expire soon:\n{text}\n{os.environ.get('BASE_URL', '')}/storage",
+    }
+
+
+def send_digest(message: dict) -> bool:
+    try:
+        send_mail(message)
+        return True
+    except Exception as e:
+        print(f"sending digest to {message['to']} failed: {e}")
+        return False
+
+
+def send_digests(
+    session: Session, as_of: date | None = None, days: int = DIGEST_DAYS, workers: int = DIGEST_WORKERS
+) -> int:
+    """Send every user with articles expiring soon one digest per day, returns the number of digests sent.
+
+    The users are claimed by setting last_digest_date before sending, so a rerun or a second worker skips them.
+    Failed digests are released again and retried by the next run.
+    """
+    as_of = as_of or date.today()
+    digests = upcoming_expirations(session, as_of, days)
+    if not digests:
+        return 0
+    claimed = set(
+        session.exec(
+            update(User)
+            .where(User.id.in_([user.id for user, _ in digests]), digest_due(as_of))
+            .values(last_digest_date=as_of)
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+    )
+    session.commit()
+    users = [user for user, _ in digests if user.id in claimed]
+    messages = [render_digest(user, articles, as_of) for user, articles in digests if user.id in claimed]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sent = list(pool.map(send_digest, messages))
+    if failed := [user.id for user, ok in zip(users, sent) if not ok]:
+        session.exec(
+            update(User)
+            .where(User.id.in_(failed), User.last_digest_date == as_of)
+            .values(last_digest_date=None)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+    return sum(sent)
+
+
+def run_digests() -> int:
+    with Session(engine) as session:
+        return send_digests(session)
+
+
+async def digest_worker(poll_seconds: float = DIGEST_POLL_SECONDS):
+    """Send the daily digests in the background, started from the app lifespan next to the outbox worker."""
+    while True:
+        if datetime.today().hour >= DIGEST_HOUR:
+            try:
+                await asyncio.to_thread(run_digests)
+            except Exception as e:
+                print(f"digest worker: {e}")
+        await asyncio.sleep(poll_seconds)
+
+
+if __name__ == "__main__":
+    if not mail_enabled():
+        print("no mail transport configured, set RESEND_API_KEY or MAIL_TRANSPORT=local")
+    else:
+        print(f"sent {run_digests()} expiry digests")
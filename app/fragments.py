@@ -0,0 +1,25 @@
+import os
+from typing import Iterable, NamedTuple, Optional
+
+from app.cache import TTLCache
+
+
+class StorageFragment(NamedTuple):
+    storage_id: int
+    html: str
+    article_count: int
+    cursor: Optional[list]
+
+
+# rendered storage tables keyed by (storage id, storage version, locale, date), bounded by their size in bytes
+storage_fragments = TTLCache(
+    maxsize=int(os.environ.get("FRAGMENT_CACHE_SIZE", 4096)),
+    ttl=24 * 3600,
+    maxweight=int(os.environ.get("FRAGMENT_CACHE_BYTES", 8 * 1024 * 1024)),
+    weigh=lambda fragment: len(fragment.html.encode()),
+)
+
+
+def invalidate_storage_fragments(storage_ids: Iterable[int]):
+    storage_ids = set(storage_ids)
+    storage_fragments.discard(lambda fragment: fragment.storage_id in storage_ids)
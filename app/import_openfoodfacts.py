@@ -0,0 +1,86 @@
+"""Pre-populate BarCodeCache from an OpenFoodFacts JSONL or CSV export.
+
+Usage: python -m app.import_openfoodfacts openfoodfacts-products.jsonl.gz
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import pathlib
+import sys
+import time
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from sqlalchemy.engine import Engine
+
+from app.controller import product_fields, upsert_statement
+from app.models import BarCodeCache
+from app.utility import engine
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+def open_dump(path: pathlib.Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return path.open("r", encoding="utf-8", errors="replace", newline="")
+
+
+def read_products(path: pathlib.Path, delimiter: str = "\t") -> Iterator[dict]:
+    """Yield one product dict at a time, never holding more than one line in memory."""
+    suffixes = [suffix for suffix in path.suffixes if suffix != ".gz"]
+    with open_dump(path) as dump:
+        if suffixes and suffixes[-1] in (".csv", ".tsv"):
+            csv.field_size_limit(sys.maxsize)
+            yield from csv.DictReader(dump, delimiter=delimiter)
+            return
+        for line in dump:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    print("Skipping invalid line", e)
+
+
+def product_rows(products: Iterable[dict]) -> Iterator[dict]:
+    fetched_at = datetime.today()
+    for product in products:
+        barcode = (product.get("code") or "").strip()
+        if barcode and product.get("product_name"):
+            yield {"barcode": barcode, "fetched_at": fetched_at, **product_fields(product)}
+
+
+def import_dump(
+    target_engine: Engine,
+    path: pathlib.Path,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    delimiter: str = "\t",
+) -> int:
+    statement = upsert_statement(target_engine.dialect.name)
+    rows = product_rows(read_products(path, delimiter))
+    total = 0
+    start = time.perf_counter()
+    while batch := list(itertools.islice(rows, batch_size)):
+        # a dump can list a barcode twice, one statement must not touch a row twice
+        batch = list({row["barcode"]: row for row in batch}.values())
+        with target_engine.begin() as connection:
+            connection.execute(statement, batch)
+        total += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f"{total} rows imported ({total / elapsed:.0f} rows/s)")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("dump", type=pathlib.Path, help="JSONL or CSV export, optionally gzipped")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--delimiter", default="\t", help="CSV delimiter, OpenFoodFacts uses tabs")
+    args = parser.parse_args()
+    import_dump(engine, args.dump, args.batch_size, args.delimiter)
+
+
+if __name__ == "__main__":
+    main()
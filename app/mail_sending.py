@@ -1,13 +1,48 @@
 import resend
 import os
+import threading
+from typing import Any, Callable
 has_api_key = os.environ.get('RESEND_API_KEY') is not None
 if has_api_key:
     resend.api_key = os.environ.get('RESEND_API_KEY')
 
+
+class LocalTransport:
+    """Stand-in for the Resend API, keeps and prints the messages instead of sending them."""
+
+    def __init__(self):
+        self.sent: list[dict] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, message: dict) -> dict:
+        with self._lock:
+            self.sent.append(message)
+            print(f'local mail to {message["to"]}: {message["subject"]}')
+            return {"id": f"local-{len(self.sent)}"}
+
+
+# sends one message in the format of resend.Emails.send, MAIL_TRANSPORT=local keeps mails on this machine
+transport: Callable[[dict], Any] = LocalTransport() if os.environ.get('MAIL_TRANSPORT') == 'local' else resend.Emails.send
+
+
+def set_transport(new_transport: Callable[[dict], Any]) -> Callable[[dict], Any]:
+    """Replace the transport, returns the previous one."""
+    global transport
+    previous, transport = transport, new_transport
+    return previous
+
+
+def mail_enabled() -> bool:
+    return has_api_key or transport is not resend.Emails.send
+
+
+def send_mail(message: dict):
+    return transport(message)
+
 def send_test_email(to_mail:str):
     if not has_api_key:
         return False
-    return resend.Emails.send({
+    return send_mail({
         "from": os.environ.get('RESEND_DOMAIN'),
         "to": to_mail,
         "subject": "Hello World",
@@ -15,17 +50,29 @@ def send_test_email(to_mail:str):
         "text": "Congrats on sending your first email from Before you go!",
     })
 
-def send_registration_mail(to_mail:str,token:str):
-    if not has_api_key:
-        return False
-    print(f'start sending registration mail to {to_mail}')
-    send_result = resend.Emails.send({
+def registration_mail(to_mail:str,token:str) -> dict:
+    return {
         "from": os.environ.get('RESEND_DOMAIN'),
         "to": to_mail,
         "subject": "Confirm your registration",
         "html": f"<p>Thanks for registering! Please confirm your registration by clicking <a href='{os.environ.get('BASE_URL')}/confirm_registration/{token}'>here</a></p>",
         "text": f"Thanks for registering! Please confirm your registration by clicking {os.environ.get('BASE_URL')}/confirm_registration/{token}"
-    })
+    }
+
+def password_reset_mail(to_mail:str,user_id:str,reset_id:str) -> dict:
+    return {
+        "from": os.environ.get('RESEND_DOMAIN'),
+        "to": to_mail,
+        "subject": "Reset your password",
+        "html": f"<p> Sorry you forgot your password. Please reset your password by clicking <a href='{os.environ.get('BASE_URL')}/password_reset/{reset_id}/{user_id}'>here</a></p>",
+        "text": f"Sorry you forgot your password. Please reset your password by clicking {os.environ.get('BASE_URL')}/password_reset/{reset_id}/{user_id}"
+    }
+
+def send_registration_mail(to_mail:str,token:str):
+    if not has_api_key:
+        return False
+    print(f'start sending registration mail to {to_mail}')
+    send_result = send_mail(registration_mail(to_mail, token))
     print(send_result)
     return send_result
 
@@ -33,12 +80,6 @@ def send_password_reset_mail(to_mail:str,user_id:str,reset_id:str):
     if not has_api_key:
         return False
     print(f'start sending reset mail to {to_mail}')
-    send_result = resend.Emails.send({
-        "from": os.environ.get('RESEND_DOMAIN'),
-        "to": to_mail,
-        "subject": "Reset your password",
-        "html": f"<p> Sorry you forgot your password. Please reset your password by clicking <a href='{os.environ.get('BASE_URL')}/password_reset/{reset_id}/{user_id}'>here</a></p>",
-        "text": f"Sorry you forgot your password. Please reset your password by clicking {os.environ.get('BASE_URL')}/password_reset/{reset_id}/{user_id}"
-    })
+    send_result = send_mail(password_reset_mail(to_mail, user_id, reset_id))
     print(send_result)
     return send_result
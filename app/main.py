@@ -1,37 +1,80 @@
+import asyncio
 import random
 import string
 import os
+from contextlib import asynccontextmanager
 from datetime import date, timedelta
+from typing import Optional
 
 from fastapi import Depends, FastAPI, Form, HTTPException, Request, status
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import RedirectResponse
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.middleware.sessions import SessionMiddleware
 
 from app.auth import app as auth_app
 from app.auth import create_access_token, get_current_user
-from app.controller_article import article_create, article_delete, article_list
+from app.controller_article import (
+    ARTICLE_PAGE_LENGTH,
+    article_consume_many,
+    article_create,
+    article_cursor,
+    article_delete,
+    article_delete_many,
+    article_first_pages,
+    article_move_many,
+    article_page,
+    article_rows,
+    article_shift_expiration_many,
+    articles_by_storage,
+    parse_article_cursor,
+)
 from app.controller_storage import storage_create, storage_delete
-from app.controller_user import user_create
-from app.models import Article, SQLModel, User
+from app.digest import digest_worker
+from app.fragments import StorageFragment, storage_fragments
+from app.mail_sending import mail_enabled
+from app.models import Article, Storage, User, bump_inventory_version, inventory_version
+from app.outbox import outbox_worker
 from app.route_user import app as user_app
 from app.route_checkin import app as checkin_app
-from app.utility import flash, get_db, get_flashed_messages, get_translations, redirect_with_token, templates, engine
+from app.utility import (
+    engine,
+    etag_headers,
+    etag_matches,
+    flash,
+    get_async_db,
+    get_flashed_messages,
+    get_locale,
+    get_read_db,
+    get_translations,
+    inventory_etag,
+    not_modified,
+    redirect_with_token,
+    request_date,
+    stream_template,
+    templates,
+)
 from app.validators import valid_article, valid_storage
 
-SQLModel.metadata.create_all(engine)
+# the schema and the admin account come from the migrate step, run `python -m app.database` before the workers start
 
-with Session(engine) as session:
-    if not os.environ.get("enable_signup") and session.exec(select(User)).first() is None:
-        user_create(session, "admin", os.environ.get("admin_password","not_a_save_password"), "a@b.com")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # every worker process sends from the shared outbox and the digests, claims keep them from sending a mail twice
+    workers = [asyncio.create_task(outbox_worker()), asyncio.create_task(digest_worker())] if mail_enabled() else []
+    yield
+    for worker in workers:
+        worker.cancel()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     SessionMiddleware,
-    secret_key="".join([random.choice(string.ascii_letters) for _ in range(32)]),
+    # set SESSION_SECRET when running several workers, flash messages must survive switching workers
+    secret_key=os.environ.get("SESSION_SECRET") or "".join([random.choice(string.ascii_letters) for _ in range(32)]),
 )
 app.include_router(user_app)
 app.include_router(checkin_app)
@@ -41,14 +84,17 @@ app.include_router(auth_app)
 async def repair_view(
     request: Request,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)):
-    all_articles = db.exec(select(Article)).all()
+    db: AsyncSession = Depends(get_async_db)):
+    all_articles = (await db.exec(select(Article))).all()
     repaired = 0
+    storage_ids = set()
     for article in all_articles:
         if article.quantity is None:
             article.quantity = 1
             repaired += 1
-    db.commit()
+            storage_ids.add(article.storage_id)
+    await db.run_sync(bump_inventory_version, storage_ids)
+    await db.commit()
     flash(request, f"Repaired {repaired} Articles", "success")
 
     return redirect_with_token(request, user,"/storage")
@@ -58,33 +104,181 @@ async def repair_view(
 async def storage_view(
     request: Request,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    storages = user.storages(db)
-    articles = user.articles(db)
+    etag = inventory_etag(request, user.id, await db.run_sync(inventory_version, user.id))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    storages = await db.run_sync(user.storages)
+    messages = get_flashed_messages(request)
     return templates.TemplateResponse(
         request,
         "storage_view.html",
-        {"storages": storages, "articles": articles, "user": user}
+        {
+            "storages": storages,
+            "storage_tables": await storage_tables(request, db, user, storages),
+            "user": user,
+        }
         | get_translations(request)
-        | get_flashed_messages(request),
+        | messages,
+        headers=etag_headers(etag, messages),
     )
 
+
+async def storage_tables(
+    request: Request, db: AsyncSession, user: User, storages: list[Storage]
+) -> dict[int, StorageFragment]:
+    """Rendered table of every storage, unchanged storages come from the fragment cache without an article query.
+
+    Only the first page of every table is rendered, DataTables loads the rest from /article_table.
+    """
+    locale, as_of = get_locale(request), request_date(request)
+    keys = {storage.id: (storage.id, storage.version, storage.name, locale, as_of) for storage in storages}
+    tables = {}
+    for storage in storages:
+        if (fragment := storage_fragments.get(keys[storage.id])) is not None:
+            tables[storage.id] = fragment
+    if missing := [storage for storage in storages if storage.id not in tables]:
+        articles, article_counts = await db.run_sync(
+            article_first_pages, user.id, storage_ids=[storage.id for storage in missing]
+        )
+        grouped = articles_by_storage(missing, articles)
+        macros = templates.env.get_template("storage_table.html").make_module(
+            get_translations(request) | {"as_of": as_of}
+        )
+        for storage in missing:
+            page = grouped[storage.id]
+            tables[storage.id] = StorageFragment(
+                storage.id,
+                str(macros.storage_table(storage, page)),
+                article_counts.get(storage.id, 0),
+                article_cursor(page[-1], storage.name, "expiration_date") if page else None,
+            )
+            storage_fragments.set(keys[storage.id], tables[storage.id])
+    return tables
+
 @app.get("/full_storage")
 async def full_storage_view(
     request: Request,
+    all: bool = False,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    storages = user.storages(db)
-    articles = user.articles(db)
+    """Every article of the user, the first page for the server-side table or with all=true the whole inventory.
+
+    The whole inventory is streamed, rows are read in batches while the page is sent.
+    """
+    etag = inventory_etag(request, user.id, await db.run_sync(inventory_version, user.id))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    storages = await db.run_sync(user.storages)
+    messages = get_flashed_messages(request)
+    context = (
+        {
+            "storages": storages,
+            "storage_names": {storage.id: storage.name for storage in storages},
+            "show_all": all,
+            "as_of": request_date(request),
+            "user": user,
+        }
+        | get_translations(request)
+        | messages
+    )
+    if all:
+        def articles():
+            with Session(engine) as session:
+                yield from article_rows(session, user.id)
+
+        return stream_template(
+            request, "full_storage_view.html", context | {"articles": articles()}, etag_headers(etag, messages)
+        )
+    article_count, _, rows = await db.run_sync(article_page, user.id)
     return templates.TemplateResponse(
         request,
         "full_storage_view.html",
-        {"storages": storages, "articles": articles, "user": user}
-        | get_translations(request)
-        | get_flashed_messages(request),
+        context
+        | {
+            "articles": [article for article, _ in rows],
+            "article_count": article_count,
+            "article_cursor": article_cursor(*rows[-1], "expiration_date") if rows else None,
+        },
+        headers=etag_headers(etag, messages),
+    )
+
+
+# sort keys of the table columns, None is not sortable
+STORAGE_TABLE_COLUMNS = ["quantity", "name", "expiration_date", None]
+FULL_TABLE_COLUMNS = [None, "quantity", "name", "storage", "expiration_date", None]
+
+
+def int_param(params, name: str, default: int) -> int:
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        return default
+
+
+@app.get("/article_table")
+async def article_table_view(
+    request: Request,
+    storage_id: Optional[int] = None,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Rows for the article tables in the DataTables server-side format (https://datatables.net/manual/server-side).
+
+    Besides draw, start, length, search[value] and order[0][...] it takes after, the cursor of the previous
+    page, to read the next page by keyset.
+    """
+    params = request.query_params
+    columns = FULL_TABLE_COLUMNS if storage_id is None else STORAGE_TABLE_COLUMNS
+    # malformed parameters fall back to the first page by expiration date
+    column = int_param(params, "order[0][column]", -1)
+    order = (columns[column] if 0 <= column < len(columns) else None) or "expiration_date"
+    length = int_param(params, "length", ARTICLE_PAGE_LENGTH)
+    total, filtered, rows = await db.run_sync(
+        article_page,
+        user.id,
+        storage_id=storage_id,
+        search=params.get("search[value]", "").strip(),
+        order=order,
+        descending=params.get("order[0][dir]") == "desc",
+        start=max(int_param(params, "start", 0), 0),
+        length=length if 0 < length <= 100 else 100,
+        after=parse_article_cursor(params["after"], order) if params.get("after") else None,
+    )
+    cells = templates.env.get_template("article_cells.html").make_module(
+        get_translations(request) | {"as_of": request_date(request)}
     )
+    if storage_id is None:
+        data = [
+            [
+                str(cells.select(article)),
+                str(cells.quantity(article)),
+                str(cells.name(article)),
+                str(cells.storage(article, storage_name)),
+                str(cells.expiration(article)),
+                str(cells.actions(article)),
+            ]
+            for article, storage_name in rows
+        ]
+    else:
+        data = [
+            [
+                str(cells.quantity(article, reduce=True)),
+                str(cells.name(article)),
+                str(cells.expiration(article, highlight_expired=True)),
+                str(cells.actions(article)),
+            ]
+            for article, _ in rows
+        ]
+    return {
+        "draw": int_param(params, "draw", 0),
+        "recordsTotal": total,
+        "recordsFiltered": filtered,
+        "data": data,
+        "cursor": article_cursor(*rows[-1], order) if rows else None,
+    }
 
 
 @app.post("/set_expiration")
@@ -93,11 +287,12 @@ async def set_expiration_view(
     article_id: int= Form(...),
     remaining_days: int= Form(...),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    if article := valid_article(db, article_id, user.id):
+    if article := await db.run_sync(valid_article, article_id, user.id):
         article.expiration_date = date.today() + timedelta(days=remaining_days)
-        db.commit()
+        await db.run_sync(bump_inventory_version, [article.storage_id])
+        await db.commit()
         flash(
             request,
             f"Expiration date updated to {article.expiration_date.strftime('%Y-%m-%d')}",
@@ -112,10 +307,11 @@ async def move_article(
     article_id: int= Form(...),
     storage_id: int = Form(...),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)):
-    if article := valid_article(db, article_id, user.id):
+    db: AsyncSession = Depends(get_async_db)):
+    if (article := await db.run_sync(valid_article, article_id, user.id)) and await db.run_sync(valid_storage, storage_id, user.id):
+        await db.run_sync(bump_inventory_version, [article.storage_id, storage_id])
         article.storage_id = storage_id
-        db.commit()
+        await db.commit()
         flash(request, f"Article moved to storage {storage_id}", "success")
     return redirect_with_token(request, user,"/storage",status_code=status.HTTP_303_SEE_OTHER)
 
@@ -125,33 +321,87 @@ async def remove_article_view(
     request: Request,
     article_id: int,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    if article := valid_article(db, article_id, user.id):
-        article_delete(db, user.id, article_id)
+    if article := await db.run_sync(valid_article, article_id, user.id):
+        await db.run_sync(article_delete, user.id, article_id)
         flash(request, f"Article {article.name} removed", "success")
     else:
         flash(request, "Article not found", "danger")
     return redirect_with_token(request, user,"/storage")
 
 
+# bulk actions of the multi-select form in full_storage_view.html, one ownership checked statement each
+
+
+@app.post("/articles/move")
+async def move_articles(
+    request: Request,
+    article_ids: list[int] = Form(...),
+    storage_id: int = Form(...),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    try:
+        moved = await db.run_sync(article_move_many, user.id, article_ids, storage_id)
+        flash(request, f"{moved} articles moved", "success")
+    except ValueError as e:
+        flash(request, str(e), "danger")
+    return redirect_with_token(request, user, "/full_storage", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@app.post("/articles/remove")
+async def remove_articles(
+    request: Request,
+    article_ids: list[int] = Form(...),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    removed = await db.run_sync(article_delete_many, user.id, article_ids)
+    flash(request, f"{removed} articles removed", "success")
+    return redirect_with_token(request, user, "/full_storage", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@app.post("/articles/shift_expiration")
+async def shift_articles_expiration(
+    request: Request,
+    article_ids: list[int] = Form(...),
+    days: int = Form(...),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    updated = await db.run_sync(article_shift_expiration_many, user.id, article_ids, days)
+    flash(request, f"Expiration date of {updated} articles shifted by {days} days", "success")
+    return redirect_with_token(request, user, "/full_storage", status_code=status.HTTP_303_SEE_OTHER)
+
+
+@app.post("/articles/consume")
+async def consume_articles(
+    request: Request,
+    article_ids: list[int] = Form(...),
+    units: int = Form(1, ge=1),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    consumed = await db.run_sync(article_consume_many, user.id, article_ids, units)
+    flash(request, f"Quantity of {consumed} articles reduced by {units}", "success")
+    return redirect_with_token(request, user, "/full_storage", status_code=status.HTTP_303_SEE_OTHER)
+
+
 @app.get("/remove_storage/{storage_id}")
 async def remove_storage_view(
     request: Request,
     storage_id: int,
+    with_articles: bool = False,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    if storage := valid_storage(db, storage_id, user.id):
-        if articles := article_list(db, user.id, storage_id):
-            flash(
-                request,
-                f"Storage not empty, {len(articles)} entries in Storage",
-                "danger",
-            )
-        else:
-            storage_delete(db, user.id, storage_id)
+    if storage := await db.run_sync(valid_storage, storage_id, user.id):
+        try:
+            await db.run_sync(storage_delete, user.id, storage_id, with_articles)
             flash(request, f"Storage {storage.name} removed", "success")
+        except ValueError as e:
+            flash(request, str(e), "danger")
     else:
         flash(request, "Storage not found", "danger")
     return redirect_with_token(request, user,"/storage")
@@ -162,9 +412,9 @@ async def create_storage_view(
     request: Request,
     storage_name: str = Form(),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    storage_create(db, user.id, storage_name)
+    await db.run_sync(storage_create, user.id, storage_name)
     flash(request, f"Storage {storage_name} created", "success")
     return redirect_with_token(request, user,"/storage",status_code=status.HTTP_303_SEE_OTHER)
 
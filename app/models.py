@@ -1,29 +1,57 @@
 from __future__ import annotations
-from typing import Optional
-from datetime import datetime,timedelta
+from typing import Iterable, NamedTuple, Optional
+from datetime import date, datetime, timedelta
+from sqlalchemy import Index, update
 from sqlmodel import create_engine
 from sqlmodel import Field, Session, SQLModel, select
 
+from app.fragments import invalidate_storage_fragments
+
+# articles count as expired this many days after their expiration date
+EXPIRED_AFTER_DAYS = 2
+
+
+class Expiry(NamedTuple):
+    days_left: int
+    is_expired: bool
+
+
+def expiry(expiration_date: datetime, as_of: date) -> Expiry:
+    """Expiry status in whole days relative to as_of, the same for every article measured on that date."""
+    days_left = (expiration_date.date() - as_of).days
+    return Expiry(days_left, days_left <= -EXPIRED_AFTER_DAYS)
+
+
 class Article(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_article_storage_id_expiration_date", "storage_id", "expiration_date"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
-    storage_id: Optional[int] = Field(default=None, foreign_key="storage.id")
-    expiration_date: datetime = Field(default_factory= lambda: datetime.today() + timedelta(days=3))
+    storage_id: Optional[int] = Field(default=None, foreign_key="storage.id", ondelete="CASCADE")
+    expiration_date: datetime = Field(default_factory= lambda: datetime.today() + timedelta(days=3), index=True)
     price: Optional[float] = Field(default=None)
     insertion_date: datetime = Field(default_factory= datetime.today)
     quantity: Optional[int] = Field(default=1)
 
+    def expiry(self, as_of: Optional[date] = None) -> Expiry:
+        """Expiry status as of the given date, pages pass the date of their request."""
+        return expiry(self.expiration_date, as_of or date.today())
+
     @property
     def is_expired(self):
-        return self.expiration_date < datetime.today()+timedelta(days=-2)
-    
+        return self.expiry().is_expired
+
     @property
     def days_left(self):
-        return (self.expiration_date - datetime.today()).days +1
+        return self.expiry().days_left
 
 class Storage(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    name: str
+    name: str = Field(index=True)
+    # bumped with the inventory version of its users, keys the rendered table fragments
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     def articles(self, session: Session):
         return session.exec(select(Article).where(Article.storage_id == self.id)).all()
@@ -35,26 +63,112 @@ class User(SQLModel, table=True):
     password_hash: str
     email: str
     is_activated: bool = False
+    # bumped by every write to the user's storages or articles, drives the ETags of the inventory views
+    inventory_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    # day of the last expiry digest, app.digest claims it before sending so a day gets one digest
+    last_digest_date: Optional[date] = Field(default=None)
 
     def storages(self, session: Session):
+        if (storages := owned_storages(session, self.id)) is not None:
+            return list(storages.values())
         return session.exec(select(Storage).join(UserStorage).where(UserStorage.user_id == self.id)).all()
 
     def articles(self, session: Session):
         return session.exec(select(Article).join(Storage).join(UserStorage).where(UserStorage.user_id == self.id).order_by(Article.expiration_date)).all()
 
+class MailOutbox(SQLModel, table=True):
+    """A mail waiting to be sent by the outbox worker, see app.outbox."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # the message for mail_sending.send_mail as JSON
+    message: str
+    created_at: datetime = Field(default_factory=datetime.today)
+    next_attempt_at: datetime = Field(default_factory=datetime.today, index=True)
+    attempts: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    sent_at: Optional[datetime] = Field(default=None, index=True)
+    last_error: Optional[str] = Field(default=None)
+
 class UserRegistration(SQLModel, table=True):
     token: str = Field(primary_key=True)
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", ondelete="CASCADE")
     registration_date: datetime = Field(default_factory=datetime.today)
 
 class UserStorage(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_userstorage_user_id_storage_id", "user_id", "storage_id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
-    storage_id: Optional[int] = Field(default=None, foreign_key="storage.id")
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id", ondelete="CASCADE")
+    storage_id: Optional[int] = Field(default=None, foreign_key="storage.id", index=True, ondelete="CASCADE")
 
 class BarCodeCache(SQLModel, table=True):
     barcode: str = Field(primary_key=True)
-    data: str
+    name: str = Field(index=True)
+    brand: Optional[str] = Field(default=None, index=True)
+    package_quantity: Optional[str] = Field(default=None)
+    fetched_at: datetime = Field(default_factory=datetime.today, index=True)
+
+    @property
+    def display_name(self):
+        return f'{self.name} ({self.brand or "-"}) - {self.package_quantity or "-"}'
+
+
+OWNED_STORAGES = "owned_storages"
+
+
+def scope_owned_storages(session: Session, user_id: int):
+    """Let this (request scoped) session answer ownership checks for user_id from memory."""
+    session.info.setdefault(OWNED_STORAGES, {}).setdefault(user_id, None)
+
+
+def reset_owned_storages(session: Session, user_id: int):
+    if user_id in session.info.get(OWNED_STORAGES, {}):
+        session.info[OWNED_STORAGES][user_id] = None
+
+
+def owned_storages(session: Session, user_id: int) -> Optional[dict[int, Storage]]:
+    """Storage id -> Storage of user_id, loaded once per scoped session, None if the session is not scoped."""
+    scope = session.info.get(OWNED_STORAGES, {})
+    if user_id not in scope:
+        return None
+    if scope[user_id] is None:
+        scope[user_id] = {
+            storage.id: storage
+            for storage in session.exec(
+                select(Storage).join(UserStorage).where(UserStorage.user_id == user_id)
+            ).all()
+        }
+    return scope[user_id]
+
+
+def bump_inventory_version(
+    session: Session, storage_ids: Iterable[int] = (), user_ids: Iterable[int] = ()
+):
+    """Count a change of storage_ids for them and every user sharing them, and for user_ids, in the caller's transaction."""
+    storage_ids, user_ids = list(storage_ids), list(user_ids)
+    if not storage_ids and not user_ids:
+        return
+    users = User.id.in_(user_ids) | User.id.in_(
+        select(UserStorage.user_id).where(UserStorage.storage_id.in_(storage_ids))
+    )
+    session.exec(
+        update(User)
+        .where(users)
+        .values(inventory_version=User.inventory_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if storage_ids:
+        session.exec(
+            update(Storage)
+            .where(Storage.id.in_(storage_ids))
+            .values(version=Storage.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        invalidate_storage_fragments(storage_ids)
+
+
+def inventory_version(session: Session, user_id: int) -> int:
+    return session.exec(select(User.inventory_version).where(User.id == user_id)).one()
 
 
 def main():
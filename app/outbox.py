@@ -0,0 +1,96 @@
+"""Durable mail queue: requests insert a MailOutbox row, a background worker sends it with retries."""
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import update
+from sqlmodel import Session, select
+
+from app.mail_sending import send_mail
+from app.models import MailOutbox
+from app.utility import engine
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 20))
+OUTBOX_POLL_SECONDS = float(os.environ.get("OUTBOX_POLL_SECONDS", 5))
+# the n-th retry waits OUTBOX_RETRY_SECONDS * 2**(n-1), at most OUTBOX_MAX_RETRY_SECONDS
+OUTBOX_RETRY_SECONDS = int(os.environ.get("OUTBOX_RETRY_SECONDS", 30))
+OUTBOX_MAX_RETRY_SECONDS = int(os.environ.get("OUTBOX_MAX_RETRY_SECONDS", 3600))
+# mails failing this often stay in the table with their last error and are not retried
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+# a claimed mail is not picked up by other workers for this long
+OUTBOX_LEASE_SECONDS = 60
+
+
+def queue_mail(session: Session, message: dict) -> MailOutbox:
+    """Add a message to the outbox, it is sent once the caller commits."""
+    mail = MailOutbox(message=json.dumps(message))
+    session.add(mail)
+    return mail
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_RETRY_SECONDS))
+
+
+def claim_batch(session: Session, now: datetime, batch_size: int = OUTBOX_BATCH_SIZE) -> list[MailOutbox]:
+    """Due mails this worker may send, claimed by moving next_attempt_at so other workers skip them."""
+    due = session.exec(
+        select(MailOutbox)
+        .where(MailOutbox.sent_at.is_(None), MailOutbox.attempts < OUTBOX_MAX_ATTEMPTS)
+        .where(MailOutbox.next_attempt_at <= now)
+        .order_by(MailOutbox.next_attempt_at, MailOutbox.id)
+        .limit(batch_size)
+    ).all()
+    claimed = []
+    for mail in due:
+        result = session.exec(
+            update(MailOutbox)
+            .where(MailOutbox.id == mail.id, MailOutbox.next_attempt_at == mail.next_attempt_at)
+            .values(next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(mail)
+    session.commit()
+    return claimed
+
+
+def deliver_batch(session: Session, now: Optional[datetime] = None, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Send one batch of due mails, returns how many were claimed."""
+    now = now or datetime.today()
+    claimed = claim_batch(session, now, batch_size)
+    for mail in claimed:
+        try:
+            send_mail(json.loads(mail.message))
+            mail.sent_at = datetime.today()
+        except Exception as e:
+            mail.attempts += 1
+            mail.last_error = str(e)
+            mail.next_attempt_at = now + retry_delay(mail.attempts)
+            print(f"sending mail {mail.id} failed ({mail.attempts}/{OUTBOX_MAX_ATTEMPTS}): {e}")
+        session.add(mail)
+        session.commit()
+    return len(claimed)
+
+
+def deliver_pending(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """Send batches until no mail is due, returns the number of mails handled."""
+    handled = 0
+    with Session(engine) as session:
+        while (count := deliver_batch(session, batch_size=batch_size)) > 0:
+            handled += count
+            if count < batch_size:
+                break
+    return handled
+
+
+async def outbox_worker(poll_seconds: float = OUTBOX_POLL_SECONDS):
+    """Deliver the outbox in the background, started from the app lifespan."""
+    while True:
+        try:
+            await asyncio.to_thread(deliver_pending)
+        except Exception as e:
+            print(f"outbox worker: {e}")
+        await asyncio.sleep(poll_seconds)
@@ -3,35 +3,46 @@ import urllib.parse
 from datetime import date, timedelta
 from typing import Optional
 
-from fastapi import APIRouter, Depends, Form, Request, status
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Depends, Form, Query, Request, status
+from fastapi.responses import JSONResponse, RedirectResponse
+from pydantic import BaseModel, Field, ValidationError
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.auth import create_access_token, get_current_user
-from app.controller import lookup_data
-from app.controller_article import article_create, article_delete
-from app.models import Session, User
-from app.utility import flash, get_db, get_flashed_messages, get_translations, redirect_with_token, templates
-from app.validators import valid_article, valid_storage
+from app.controller import barcode_cache, lookup_data_async, lookup_many_async
+from app.controller_article import article_consume, article_create, article_create_many
+from app.models import User
+from app.utility import flash, get_async_db, get_flashed_messages, get_read_db, get_translations, redirect_with_token, request_date, templates
+from app.validators import valid_storage
 
 app = APIRouter()
 
 
+class CheckinEntry(BaseModel):
+    barcode: Optional[str] = ""
+    name: Optional[str] = ""
+    storage_id: int
+    expiration_date: date
+    quantity: int = Field(1, ge=1)
+    price: Optional[float] = Field(None, ge=0)
+
 
 @app.get("/checkin")
 async def checkin_view(
     request: Request,
     storage_id: Optional[int] = None,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    storages = user.storages(db)
-    articles = user.articles(db)
+    storages = await db.run_sync(user.storages)
+    articles = await db.run_sync(user.articles)
     return templates.TemplateResponse(
         request,
         "article_check_in.html",
         {
             "storages": storages,
             "articles": articles,
+            "as_of": request_date(request),
             "user": user,
             "selected_storage_id": storage_id,
         }
@@ -44,16 +55,16 @@ async def checkin_view(
 async def checkin_view_post(
     request: Request,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     barcode: Optional[str] = Form(""),
     name: Optional[str] = Form(""),
     storage_id: int = Form(...),
 ):
     if barcode and not name:
-        name = lookup_data(db, barcode)
+        name = await lookup_data_async(db, barcode)
     elif not barcode and not name:
         raise ValueError("Barcode or name required")
-    if storage := valid_storage(db, storage_id, user.id):
+    if storage := await db.run_sync(valid_storage, storage_id, user.id):
         return redirect_with_token(
             request,
             user,
@@ -70,10 +81,10 @@ async def checkin_date_view(
     name: str,
     storage_id: int,
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    storage = valid_storage(db, storage_id, user.id)
-    storages = user.storages(db)
+    storage = await db.run_sync(valid_storage, storage_id, user.id)
+    storages = await db.run_sync(user.storages)
 
     first_of_month, first_of_next_month, days = calculate_calendar_dates()
 
@@ -117,15 +128,12 @@ def calculate_calendar_dates():
 async def reduce_quantity_view(
     request: Request,
     article_id: int,
+    units: int = Query(1, ge=1),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    if article := valid_article(db, article_id, user.id):
-        article.quantity -= 1
-        if article.quantity < 1:
-            article_delete(db, user.id, article_id)
-        db.commit()
-        flash(request, f"Quantity reduced to {article.quantity}", "success")
+    if consumed := await db.run_sync(article_consume, user.id, article_id, units):
+        flash(request, f"Quantity reduced to {consumed[0]}", "success")
     else:
         flash(request, "Article not found", "danger")
     return redirect_with_token(request, user,"/storage")
@@ -138,10 +146,10 @@ async def checkin_date_view_post(
     expiration_date: date = Form(...),
     quantity: int = Form(1),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    storage = valid_storage(db, storage_id, user.id)
-    new_article = article_create(db, user.id, name, storage.id, expiration_date,quantity)
+    storage = await db.run_sync(valid_storage, storage_id, user.id)
+    new_article = await db.run_sync(article_create, user.id, name, storage.id, expiration_date, quantity)
     flash(
         request,
         f"Article added: {new_article.quantity}x {new_article.name} in {storage.name} with expiration date {new_article.expiration_date}",
@@ -153,3 +161,79 @@ async def checkin_date_view_post(
         user,
         url=f"/checkin?storage_id={storage_id}",
         status_code=status.HTTP_303_SEE_OTHER)
+
+
+@app.get("/barcode_cache_stats")
+async def barcode_cache_stats_view(user: User = Depends(get_current_user)):
+    return barcode_cache.stats()
+
+
+def parse_checkin_entry(number: int, entry: dict) -> CheckinEntry:
+    try:
+        return CheckinEntry(**entry)
+    except ValidationError as e:
+        problems = ", ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+        raise ValueError(f"Article {number}: {problems}") from None
+
+
+async def read_checkin_entries(request: Request) -> list[CheckinEntry]:
+    """Batch entries from a JSON list (or {"articles": [...]}) or from parallel form columns."""
+    if request.headers.get("content-type", "").startswith("application/json"):
+        payload = await request.json()
+        if isinstance(payload, dict):
+            payload = payload.get("articles", [])
+        if not isinstance(payload, list) or not all(isinstance(entry, dict) for entry in payload):
+            raise ValueError("Expected a list of article objects")
+        return [parse_checkin_entry(number, entry) for number, entry in enumerate(payload, 1)]
+    form = await request.form()
+    columns = ["barcode", "name", "storage_id", "expiration_date", "quantity"]
+    if "price" in form:
+        columns.append("price")
+    values = {column: form.getlist(column) for column in columns}
+    if len({len(column) for column in values.values()}) > 1:
+        raise ValueError("Every article needs " + ", ".join(columns))
+    rows = zip(*values.values())
+    return [parse_checkin_entry(number, dict(zip(columns, row))) for number, row in enumerate(rows, 1)]
+
+
+@app.post("/checkin_batch")
+async def checkin_batch_view_post(
+    request: Request,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    is_json = request.headers.get("content-type", "").startswith("application/json")
+    try:
+        entries = await read_checkin_entries(request)
+        products = await lookup_many_async(
+            db, [entry.barcode for entry in entries if entry.barcode and not entry.name]
+        )
+        for entry in entries:
+            if not entry.name:
+                if not entry.barcode:
+                    raise ValueError("Barcode or name required")
+                product = products.get(entry.barcode)
+                entry.name = product.display_name if product else entry.barcode
+        created = await db.run_sync(
+            article_create_many,
+            user.id,
+            [
+                {
+                    "name": entry.name,
+                    "storage_id_or_name": entry.storage_id,
+                    "expiration_date": entry.expiration_date,
+                    "quantity": entry.quantity,
+                    "price": entry.price,
+                }
+                for entry in entries
+            ],
+        )
+    except ValueError as e:
+        if is_json:
+            return JSONResponse({"success": False, "message": str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+        flash(request, str(e), "danger")
+        return redirect_with_token(request, user, "/checkin")
+    if is_json:
+        return {"success": True, "message": f"{created} articles added", "created": created}
+    flash(request, f"{created} articles added", "success")
+    return redirect_with_token(request, user, "/storage")
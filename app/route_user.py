@@ -2,10 +2,11 @@ import os
 from fastapi import APIRouter, Request, Form, Depends, status
 from fastapi.responses import RedirectResponse
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.controller_user import user_activate, user_create, user_login, user_update
-from app.models import Session, User
-from app.utility import get_db, flash, get_flashed_messages, get_translations, templates
+from app.controller_user import user_activate, user_create_async, user_login_async, user_update
+from app.models import User
+from app.utility import get_async_db, flash, get_flashed_messages, get_translations, templates, token_refresh_stats
 from app.auth import create_access_token, get_current_user
 
 app = APIRouter()
@@ -28,10 +29,10 @@ async def login_view_post(
     request: Request,
     name: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     try:
-        if user := user_login(db, name, password):
+        if user := await user_login_async(db, name, password):
             result = RedirectResponse(url="/storage", status_code=status.HTTP_303_SEE_OTHER)
             result.set_cookie(
                 key="access_token",
@@ -41,7 +42,7 @@ async def login_view_post(
             return result
     except ValueError as e:
         
-        users = db.exec(select(User)).all()
+        users = (await db.exec(select(User))).all()
         print(', '.join([user.name for user in users]))
         flash(request,f"Wrong Username or Password {e}","danger")
 
@@ -60,13 +61,13 @@ async def register_view_post(
     name: str = Form(...),
     password: str = Form(...),
     email: str = Form(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if not os.environ.get("enable_signup"):
         flash(request,"Signup disabled","danger")
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     try:
-        user_create(db, name, password, email, with_registration=True)
+        await user_create_async(db, name, password, email, with_registration=True)
         flash(request,"User created, check you mail before you can log in","success")
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
     except ValueError as e:
@@ -74,12 +75,16 @@ async def register_view_post(
         return RedirectResponse(url="/register", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.get("/confirm_registration/{token}")
-async def activate_user_view(request: Request, token: str, db: Session = Depends(get_db)):
-    user = user_activate(db,token)
+async def activate_user_view(request: Request, token: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.run_sync(user_activate, token)
     return RedirectResponse(url=f"/login?username={user.name}", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.get("/clear_mail")
-async def clear_mail_view(request: Request, db: Session = Depends(get_db), user:User = Depends(get_current_user)):
-    user_update(db, user.id, email="")
+async def clear_mail_view(request: Request, db: AsyncSession = Depends(get_async_db), user:User = Depends(get_current_user)):
+    await db.run_sync(user_update, user.id, email="")
     flash(request,"Mail cleared","success")
-    return RedirectResponse(url="/storage", status_code=status.HTTP_303_SEE_OTHER)
\ No newline at end of file
+    return RedirectResponse(url="/storage", status_code=status.HTTP_303_SEE_OTHER)
+
+@app.get("/token_refresh_stats")
+async def token_refresh_stats_view(user: User = Depends(get_current_user)):
+    return token_refresh_stats
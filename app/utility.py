@@ -1,18 +1,23 @@
 
-from datetime import datetime, timedelta, timezone
-from fastapi.responses import RedirectResponse
-from sqlmodel import Session,create_engine
+from datetime import date, datetime, timedelta, timezone
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
 from fastapi import Request,status
 import typing
 from fastapi.templating import Jinja2Templates
 import string
+import hashlib
 import json
 import pathlib
 import os
 from jose import JWTError, jwt
 
+from app.database import create_database_engine
 
-engine = create_engine("sqlite:///database/database.db")
+# sync engine for alembic, scripts and startup, request handlers use async_engine, read only views read_engine
+engine = create_database_engine()
+async_engine = create_database_engine(asynchronous=True)
+read_engine = create_database_engine(asynchronous=True, read_only=True)
 
 
 # get secret from environment variable
@@ -21,6 +26,9 @@ JWT_KEY = os.environ.get(
 )
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 180
+# redirects only mint a new token once the current one expires within this window
+TOKEN_REFRESH_WINDOW_MINUTES = int(os.environ.get("TOKEN_REFRESH_WINDOW_MINUTES", 30))
+token_refresh_stats = {"reused": 0, "refreshed": 0}
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
@@ -28,8 +36,15 @@ def create_access_token(data: dict) -> str:
     to_encode["exp"] = expire
     return jwt.encode(to_encode, JWT_KEY, algorithm=ALGORITHM)
 
-def get_db():
-    with Session(engine) as session:
+async def get_async_db():
+    # keep loaded attributes after commit, lazy loads are not possible outside run_sync
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_read_db():
+    """Session on the read only pool for views that do not write, reads do not queue behind writes."""
+    async with AsyncSession(read_engine, expire_on_commit=False) as session:
         yield session
 
 
@@ -75,18 +90,98 @@ locales: dict[str, dict[str, str]] = {
 }
 
 
-def get_translations(request: Request) -> dict[str, str]:
+def get_locale(request: Request) -> str:
     requested_languages: list[str] = request.headers.get("Accept-Language", "en").split(
         ","
     )
     for language in requested_languages:
         clean_language = language.split("-")[0].lower()
         if clean_language in locales:
-            return locales[clean_language]
-    return locales["en"]
+            return clean_language
+    return "en"
+
+
+def get_translations(request: Request) -> dict[str, str]:
+    return locales[get_locale(request)]
+
+
+def request_date(request: Request) -> date:
+    """Reference date of the request, every article on a page gets its expiry status as of this date."""
+    if not hasattr(request.state, "as_of"):
+        request.state.as_of = date.today()
+    return request.state.as_of
+
+
+# part of every ETag, so a deploy with changed templates does not answer 304 with stale pages
+TEMPLATES_VERSION = max(int(file.stat().st_mtime) for file in pathlib.Path("app/templates").iterdir())
+
+
+def inventory_etag(request: Request, user_id: int, version: int) -> str:
+    """Strong ETag of an inventory page, days left change daily so the date is part of it."""
+    key = f"{request.url.path}?{request.url.query}:{user_id}:{version}:{request_date(request)}:{get_locale(request)}:{TEMPLATES_VERSION}"
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # pending flash messages are only shown by a fresh render
+    if request.session.get("_messages"):
+        return False
+    if_none_match = request.headers.get("If-None-Match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*"
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+
+
+def etag_headers(etag: str, flashed_messages: typing.Optional[dict] = None) -> dict[str, str]:
+    """Caching headers of an inventory page, flashed_messages is what the render got from get_flashed_messages."""
+    # a page showing flash messages must not be stored or revalidated, a 304 would show them again
+    if flashed_messages:
+        return {"Cache-Control": "no-store"}
+    # browsers revalidate on every load, the 304 saves the queries and the render
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Cookie, Accept-Language"}
+
+def stream_template(
+    request: Request, name: str, context: dict, headers: typing.Optional[dict] = None, chunk_size: int = 8192
+) -> StreamingResponse:
+    """Render a template with Jinja's generate() and send it in chunks of about chunk_size characters.
+
+    Iterators in the context are consumed while the page is sent, the response starts before they are exhausted.
+    """
+    template = templates.get_template(name)
+
+    def chunks():
+        buffer, size = [], 0
+        for part in template.generate({"request": request} | context):
+            buffer.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield "".join(buffer)
+                buffer, size = [], 0
+        yield "".join(buffer)
+
+    # a sync iterator, starlette advances it in the threadpool
+    return StreamingResponse(chunks(), media_type="text/html; charset=utf-8", headers=headers)
+
+
+def token_needs_refresh(request: Request) -> bool:
+    token = request.cookies.get("access_token", "").removeprefix("Bearer ")
+    try:
+        # the dependency chain already verified the signature, only exp is needed here
+        expires = jwt.get_unverified_claims(token)["exp"]
+    except (JWTError, KeyError):
+        return True
+    remaining = expires - datetime.now(timezone.utc).timestamp()
+    return remaining < TOKEN_REFRESH_WINDOW_MINUTES * 60
+
 
 def redirect_with_token(request: Request, user: "User",url:str,status_code:int=status.HTTP_303_SEE_OTHER) -> RedirectResponse:
     result = RedirectResponse(url=url, status_code=status_code)
+    if not token_needs_refresh(request):
+        token_refresh_stats["reused"] += 1
+        return result
+    token_refresh_stats["refreshed"] += 1
     result.set_cookie(
         key="access_token", value=f'Bearer {create_access_token({"sub": user.name})}'
     )
@@ -7,6 +7,7 @@ from app.models import (
     Storage,
     User,
     UserStorage,
+    owned_storages,
 )
 
 def validate_new_user_name(session: Session, name: str):
@@ -19,33 +20,32 @@ def validate_new_user_name(session: Session, name: str):
 def valid_storage(
     session: Session, storage_id_or_name: int | str, user_id: int
 ) -> Optional[Storage]:
-    if isinstance(storage_id_or_name, int):
-        if _ := session.exec(
-            select(UserStorage).where(
-                UserStorage.storage_id == storage_id_or_name
-                and UserStorage.user_id == user_id
-            )
-        ).all():
-            return session.exec(
-                select(Storage).where(Storage.id == storage_id_or_name)
-            ).first()
-        return None
-    storage = session.exec(
-        select(Storage).where(Storage.name == storage_id_or_name)
-    ).first()
-    if not storage:
+    if storage_id_or_name is None:
         return None
-    user_storage = session.exec(
-        select(UserStorage).where(
-            UserStorage.storage_id == storage.id and UserStorage.user_id == user_id
+    if (storages := owned_storages(session, user_id)) is not None:
+        if isinstance(storage_id_or_name, int):
+            return storages.get(storage_id_or_name)
+        return next(
+            (storage for storage in storages.values() if storage.name == storage_id_or_name),
+            None,
         )
+    if isinstance(storage_id_or_name, int):
+        condition = Storage.id == storage_id_or_name
+    else:
+        condition = Storage.name == storage_id_or_name
+    return session.exec(
+        select(Storage)
+        .join(UserStorage, UserStorage.storage_id == Storage.id)
+        .where(condition, UserStorage.user_id == user_id)
     ).first()
-    return storage if user_storage else None
 
 
 def valid_article(session: Session, article_id: int, user_id: int) -> Optional[Article]:
-    article = session.exec(select(Article).where(Article.id == article_id)).first()
-    if not article:
-        return None
-    storage = valid_storage(session, article.storage_id, user_id)
-    return article if storage else None
+    if (storages := owned_storages(session, user_id)) is not None:
+        article = session.get(Article, article_id)
+        return article if article and article.storage_id in storages else None
+    return session.exec(
+        select(Article)
+        .join(UserStorage, UserStorage.storage_id == Article.storage_id)
+        .where(Article.id == article_id, UserStorage.user_id == user_id)
+    ).first()
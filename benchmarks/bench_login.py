@@ -0,0 +1,141 @@
+"""Measure login throughput and /storage latency while logins are running.
+
+Usage: python benchmarks/bench_login.py [--logins 40] [--concurrency 8] [--inline]
+
+--inline checks passwords on the event loop like before the bcrypt pool, for comparison.
+"""
+import argparse
+import asyncio
+import pathlib
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(".")
+import httpx
+import uvicorn
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app import route_user
+from app.controller_storage import storage_create
+from app.controller_user import user_create, user_login
+from app.database import create_database_engine
+from app.main import app
+from app.utility import create_access_token, get_async_db, get_read_db
+
+
+def start_server() -> tuple[uvicorn.Server, str]:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def poll_storage(base_url: str, token: str, stop: asyncio.Event) -> list[float]:
+    timings = []
+    async with httpx.AsyncClient(base_url=base_url, cookies={"access_token": f"Bearer {token}"}) as client:
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = await client.get("/storage")
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.text
+            assert "Fridge" in response.text, response.text
+            await asyncio.sleep(0.01)
+    return timings
+
+
+async def login_load(base_url: str, logins: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login(client: httpx.AsyncClient):
+        async with semaphore:
+            response = await client.post("/login", data={"name": "bench", "password": "bench"})
+            assert "access_token" in response.cookies, response.text
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        await asyncio.gather(*(login(client) for _ in range(logins)))
+    return logins / (time.perf_counter() - start)
+
+
+async def run(base_url: str, token: str, logins: int, concurrency: int):
+    stop = asyncio.Event()
+    idle = asyncio.create_task(poll_storage(base_url, token, stop))
+    await asyncio.sleep(1)
+    stop.set()
+    idle_timings = await idle
+
+    stop = asyncio.Event()
+    loaded = asyncio.create_task(poll_storage(base_url, token, stop))
+    throughput = await login_load(base_url, logins, concurrency)
+    stop.set()
+    return idle_timings, await loaded, throughput
+
+
+def describe(timings: list[float]) -> str:
+    timings = sorted(timings)
+    p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+    return f"median {statistics.median(timings):.1f} ms, p95 {p95:.1f} ms, max {timings[-1]:.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+
+    if args.inline:
+        async def inline_login(session, name, password):
+            return await session.run_sync(user_login, name, password)
+
+        route_user.user_login_async = inline_login
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{pathlib.Path(directory, 'bench.db')}",
+            connect_args={"check_same_thread": False},
+        )
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            user = user_create(session, "bench", "bench", "")
+            storage_create(session, user.id, "Fridge")
+
+        url = f"sqlite:///{pathlib.Path(directory, 'bench.db')}"
+        async_engine = create_database_engine(url, asynchronous=True)
+        read_engine = create_database_engine(url, asynchronous=True, read_only=True)
+
+        async def get_bench_db():
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                yield session
+
+        async def get_bench_read_db():
+            async with AsyncSession(read_engine, expire_on_commit=False) as session:
+                yield session
+
+        app.dependency_overrides[get_async_db] = get_bench_db
+        app.dependency_overrides[get_read_db] = get_bench_read_db
+        server, base_url = start_server()
+        try:
+            idle, loaded, throughput = asyncio.run(
+                run(base_url, create_access_token({"sub": "bench"}), args.logins, args.concurrency)
+            )
+        finally:
+            server.should_exit = True
+            app.dependency_overrides.pop(get_async_db)
+            app.dependency_overrides.pop(get_read_db)
+
+    mode = "inline" if args.inline else "bcrypt pool"
+    print(f"{args.logins} logins, {args.concurrency} concurrent, {mode}")
+    print(f"login throughput: {throughput:.1f} logins/s")
+    print(f"/storage idle:        {describe(idle)}")
+    print(f"/storage under login: {describe(loaded)}")
+
+
+if __name__ == "__main__":
+    main()
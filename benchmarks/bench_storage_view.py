@@ -0,0 +1,148 @@
+"""Measure /storage latency on a seeded database, without and with the hot path indexes.
+
+Usage: python benchmarks/bench_storage_view.py [--articles 100000] [--requests 50]
+
+The principal and storage table caches are cleared before every request, each request renders cold.
+"""
+import argparse
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(".")
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine, insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.auth import principal_cache
+from app.database import create_database_engine
+from app.fragments import storage_fragments
+from app.main import app
+from app.models import Article, Storage, User, UserStorage
+from app.utility import create_access_token, get_async_db, get_read_db
+
+INDEXES = [
+    "ix_article_storage_id_expiration_date",
+    "ix_article_expiration_date",
+    "ix_userstorage_user_id_storage_id",
+    "ix_userstorage_storage_id",
+    "ix_storage_name",
+]
+
+
+def seed(engine, articles: int, users: int, storages_per_user: int):
+    """Spread the articles evenly over users x storages_per_user storages."""
+    storage_count = users * storages_per_user
+    today = datetime.today()
+    with Session(engine) as session:
+        session.exec(
+            insert(User),
+            params=[
+                {"name": f"bench{i}", "password_hash": "-", "email": "", "is_activated": True}
+                for i in range(users)
+            ],
+        )
+        session.exec(
+            insert(Storage),
+            params=[{"name": f"storage{i}"} for i in range(storage_count)],
+        )
+        session.exec(
+            insert(UserStorage),
+            params=[
+                {"user_id": i // storages_per_user + 1, "storage_id": i + 1}
+                for i in range(storage_count)
+            ],
+        )
+        session.exec(
+            insert(Article),
+            params=[
+                {
+                    "name": f"article{i}",
+                    "storage_id": i % storage_count + 1,
+                    "expiration_date": today + timedelta(days=i % 60 - 10),
+                    "insertion_date": today,
+                    "quantity": 1,
+                }
+                for i in range(articles)
+            ],
+        )
+        session.commit()
+
+
+def measure(client: TestClient, token: str, requests: int) -> dict[str, float]:
+    timings = []
+    client.cookies.set("access_token", f"Bearer {token}")
+    client.get("/storage")
+    for _ in range(requests):
+        principal_cache.clear()
+        storage_fragments.clear()
+        start = time.perf_counter()
+        response = client.get("/storage")
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.text
+        # the page must come from the seeded database, not from database/database.db
+        assert "storage0" in response.text and "article0" in response.text, response.text
+    timings.sort()
+    return {
+        "median": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--articles", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--storages-per-user", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{pathlib.Path(directory, 'bench.db')}")
+        SQLModel.metadata.create_all(engine)
+        seed(engine, args.articles, args.users, args.storages_per_user)
+
+        url = f"sqlite:///{pathlib.Path(directory, 'bench.db')}"
+        async_engine = create_database_engine(url, asynchronous=True)
+        read_engine = create_database_engine(url, asynchronous=True, read_only=True)
+
+        async def get_bench_db():
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                yield session
+
+        async def get_bench_read_db():
+            async with AsyncSession(read_engine, expire_on_commit=False) as session:
+                yield session
+
+        app.dependency_overrides[get_async_db] = get_bench_db
+        app.dependency_overrides[get_read_db] = get_bench_read_db
+        client = TestClient(app)
+        token = create_access_token({"sub": "bench0"})
+        try:
+            with engine.begin() as connection:
+                for index_name in INDEXES:
+                    connection.execute(text(f"DROP INDEX {index_name}"))
+                connection.execute(text("ANALYZE"))
+            before = measure(client, token, args.requests)
+            for table in SQLModel.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(engine, checkfirst=True)
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE"))
+            after = measure(client, token, args.requests)
+        finally:
+            app.dependency_overrides.pop(get_async_db)
+            app.dependency_overrides.pop(get_read_db)
+            engine.dispose()
+
+    print(f"/storage with {args.articles} articles, {args.requests} requests")
+    print(f"without indexes: median {before['median']:.1f} ms, p95 {before['p95']:.1f} ms")
+    print(f"with indexes:    median {after['median']:.1f} ms, p95 {after['p95']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
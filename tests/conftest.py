@@ -0,0 +1,33 @@
+import sys
+
+import pytest
+from sqlmodel import Session, SQLModel
+
+sys.path.append(".")
+from app import mail_sending
+from app.database import create_database_engine, migrate
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    """The app database at DATABASE_URL, prepared by the same migrate step as a deployment."""
+    migrate()
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A session on a fresh SQLite file with the production connection settings."""
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+@pytest.fixture
+def outbox():
+    """Mails sent while the test runs, instead of calling the mail API."""
+    local = mail_sending.LocalTransport()
+    previous = mail_sending.set_transport(local)
+    yield local
+    mail_sending.set_transport(previous)
@@ -1,9 +1,18 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 from unittest.mock import MagicMock, patch
 
 import pytest
-from sqlmodel import Session
+from sqlmodel import Session, SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.controller import lookup_data
+from app.cache import TTLCache
+from app.controller import api, barcode_cache, lookup_data, lookup_data_async, lookup_many, store_products
+from app.database import create_database_engine
 from app.models import BarCodeCache
 import openfoodfacts
 
@@ -12,18 +21,34 @@ def session():
     return MagicMock(spec=Session)
 
 
+@pytest.fixture(autouse=True)
+def clear_barcode_cache():
+    barcode_cache.clear()
+    yield
+    barcode_cache.clear()
+
+
+def added_products(session) -> list[dict]:
+    """Rows passed to the BarCodeCache upsert."""
+    return [
+        {column: product[column] for column in ("barcode", "name", "brand", "package_quantity")}
+        for args, kwargs in session.exec.call_args_list
+        if args[0].is_insert
+        for product in kwargs["params"]
+    ]
+
+
 def test_lookup_data_cache_hit(session:Session):
     barcode = "123456789"
-    cache_data = "Product (Brand) - 100g"
-    session.exec.return_value.first.return_value = BarCodeCache(
-        barcode=barcode, data=cache_data
-    )
+    session.exec.return_value.all.return_value = [
+        BarCodeCache(barcode=barcode, name="Product", brand="Brand", package_quantity="100g")
+    ]
 
     result = lookup_data(session, barcode)
 
-    assert result == cache_data
+    assert result == "Product (Brand) - 100g"
     session.exec.assert_called_once()
-    session.add.assert_not_called()
+    assert added_products(session) == []
     session.commit.assert_not_called()
 
 
@@ -32,15 +57,14 @@ def test_lookup_data_cache_miss(api_get_mock:openfoodfacts.API, session:Session)
     barcode = "123456789"
     api_data = {"product_name": "Product", "brands": "Brand", "quantity": "100g"}
     api_get_mock.return_value = api_data
-    session.exec.return_value.first.return_value = None
+    session.exec.return_value.all.return_value = []
 
     result = lookup_data(session, barcode)
 
-    expected_data_str = "Product (Brand) - 100g"
-    assert result == expected_data_str
-    session.add.assert_called_once_with(
-        BarCodeCache(barcode=barcode, data=expected_data_str)
-    )
+    assert result == "Product (Brand) - 100g"
+    assert added_products(session) == [
+        {"barcode": barcode, "name": "Product", "brand": "Brand", "package_quantity": "100g"}
+    ]
     session.commit.assert_called_once()
 
 
@@ -49,15 +73,14 @@ def test_lookup_data_missing_fields(api_get_mock:openfoodfacts.API, session:Sess
     barcode = "123456789"
     api_data = {"product_name": "Product", "brands": "Brand"}
     api_get_mock.return_value = api_data
-    session.exec.return_value.first.return_value = None
+    session.exec.return_value.all.return_value = []
 
     result = lookup_data(session, barcode)
 
-    expected_data_str = "Product (Brand) - -"
-    assert result == expected_data_str
-    session.add.assert_called_once_with(
-        BarCodeCache(barcode=barcode, data=expected_data_str)
-    )
+    assert result == "Product (Brand) - -"
+    assert added_products(session) == [
+        {"barcode": barcode, "name": "Product", "brand": "Brand", "package_quantity": None}
+    ]
     session.commit.assert_called_once()
 
 
@@ -65,10 +88,193 @@ def test_lookup_data_missing_fields(api_get_mock:openfoodfacts.API, session:Sess
 def test_lookup_data_api_error(api_get_mock:openfoodfacts.API, session:Session):
     barcode = "123456789"
     api_get_mock.side_effect = ValueError("API error")
-    session.exec.return_value.first.return_value = None
+    session.exec.return_value.all.return_value = []
 
     result = lookup_data(session, barcode)
 
     assert result == ""
-    session.add.assert_not_called()
+    assert added_products(session) == []
     session.commit.assert_not_called()
+
+
+def test_lookup_data_memory_hit_skips_database(session:Session):
+    barcode = "123456789"
+    session.exec.return_value.all.return_value = [
+        BarCodeCache(barcode=barcode, name="Product", brand="Brand", package_quantity="100g")
+    ]
+
+    assert lookup_data(session, barcode) == "Product (Brand) - 100g"
+    assert lookup_data(session, barcode) == "Product (Brand) - 100g"
+
+    session.exec.assert_called_once()
+    assert barcode_cache.stats()["hits"] == 1
+
+
+@patch("app.controller.api.product.get")
+def test_lookup_data_not_found_is_cached(api_get_mock:openfoodfacts.API, session:Session):
+    api_get_mock.return_value = None
+    session.exec.return_value.all.return_value = []
+
+    assert lookup_data(session, "123456789") == ""
+    assert lookup_data(session, "123456789") == ""
+
+    api_get_mock.assert_called_once()
+    assert added_products(session) == []
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "evictions": 1}
+    assert (cache.peek("a"), cache.peek("b", "missing")) == (1, "missing")
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("negative", "", ttl=-1)
+
+    assert cache.get("negative") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_keeps_weight_below_budget():
+    cache = TTLCache(maxsize=10, ttl=60, maxweight=10, weigh=len)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    cache.get("a")
+    cache.set("c", "cccc")
+    cache.set("huge", "h" * 11)
+
+    assert cache.get("b") is None
+    assert cache.get("huge") is None
+    assert (cache.get("a"), cache.get("c")) == ("aaaa", "cccc")
+    assert cache.stats()["weight"] == 8
+
+
+class OpenFoodFactsStub(BaseHTTPRequestHandler):
+    requests: list[str] = []
+
+    def do_GET(self):
+        OpenFoodFactsStub.requests.append(self.path)
+        time.sleep(0.2)
+        product = {"product_name": "Stub", "brands": "Brand", "quantity": "1l"}
+        if self.path.startswith("/api/v2/search"):
+            codes = parse_qs(urlparse(self.path).query)["code"][0].split(",")
+            body = json.dumps(
+                {"products": [product | {"code": code} for code in codes if code != "0000"]}
+            ).encode()
+        else:
+            body = json.dumps({"status": 1, "product": product}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def openfoodfacts_stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenFoodFactsStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    original_url = api.product.base_url
+    api.product.base_url = f"http://127.0.0.1:{server.server_port}"
+    OpenFoodFactsStub.requests = []
+    yield OpenFoodFactsStub
+    api.product.base_url = original_url
+    server.shutdown()
+
+
+def async_session(session) -> AsyncSession:
+    """Wrap a sync session mock the way AsyncSession.run_sync hands it to the controllers."""
+    wrapper = MagicMock(spec=AsyncSession)
+
+    async def run_sync(fn, *args, **kwargs):
+        return fn(session, *args, **kwargs)
+
+    wrapper.run_sync.side_effect = run_sync
+    return wrapper
+
+
+def test_lookup_data_async_coalesces_requests(openfoodfacts_stub):
+    sync_sessions = [MagicMock(spec=Session) for _ in range(3)]
+    for session in sync_sessions:
+        session.exec.return_value.all.return_value = []
+    sessions = [async_session(session) for session in sync_sessions]
+
+    async def scan_concurrently():
+        return await asyncio.gather(
+            *(lookup_data_async(session, "4000000000001") for session in sessions)
+        )
+
+    results = asyncio.run(scan_concurrently())
+
+    assert results == ["Stub (Brand) - 1l"] * 3
+    assert len(openfoodfacts_stub.requests) == 1
+    assert openfoodfacts_stub.requests[0].startswith("/api/v2/product/4000000000001")
+    # one miss per scan, the first to finish stores the product and the others only peek at it
+    assert (barcode_cache.stats()["hits"], barcode_cache.stats()["misses"]) == (0, 3)
+    assert sum(len(added_products(session)) for session in sync_sessions) == 1
+
+
+def test_lookup_data_async_does_not_block_loop(openfoodfacts_stub):
+    session = MagicMock(spec=Session)
+    session.exec.return_value.all.return_value = []
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def scan_and_tick():
+        await asyncio.gather(lookup_data_async(async_session(session), "4000000000002"), ticker())
+
+    asyncio.run(scan_and_tick())
+
+    assert len(ticks) == 5
+    assert ticks[-1] - ticks[0] < 0.15
+
+
+def test_lookup_many_batches_misses(openfoodfacts_stub, session:Session):
+    session.exec.return_value.all.return_value = [
+        BarCodeCache(barcode="1111", name="Cached")
+    ]
+
+    products = lookup_many(session, ["1111", "2222", "3333", "0000", "2222"])
+
+    assert {barcode: product.name for barcode, product in products.items()} == {
+        "1111": "Cached",
+        "2222": "Stub",
+        "3333": "Stub",
+    }
+    assert session.exec.call_count == 2
+    assert len(openfoodfacts_stub.requests) == 1
+    assert "code=2222,3333,0000&" in openfoodfacts_stub.requests[0]
+    assert sorted(product["barcode"] for product in added_products(session)) == ["2222", "3333"]
+    session.commit.assert_called_once()
+
+    assert lookup_many(session, ["0000", "1111"]).keys() == {"1111"}
+    assert len(openfoodfacts_stub.requests) == 1
+
+
+def test_store_products_tolerates_a_concurrent_insert(tmp_path):
+    engine = create_database_engine(f"sqlite:///{tmp_path / 'barcodes.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as first, Session(engine) as second:
+        # both workers missed the cache and fetched the barcode before either stored it
+        store_products(first, ["1111"], {"1111": BarCodeCache(barcode="1111", name="Old")})
+        store_products(second, ["1111"], {"1111": BarCodeCache(barcode="1111", name="New")})
+        assert [product.name for product in second.exec(select(BarCodeCache))] == ["New"]
+    engine.dispose()
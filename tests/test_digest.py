@@ -0,0 +1,94 @@
+import sys
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+sys.path.append(".")
+from app import mail_sending
+from app.digest import send_digests, upcoming_expirations
+from app.models import Article, Storage, User, UserStorage
+
+
+def add_user(session: Session, name: str, storage_name: str, **fields) -> Storage:
+    user = User(name=name, password_hash="", email=f"{name}@mail.de", **({"is_activated": True} | fields))
+    storage = Storage(name=storage_name)
+    session.add_all([user, storage])
+    session.flush()
+    session.add(UserStorage(user_id=user.id, storage_id=storage.id))
+    return storage
+
+
+def test_upcoming_expirations_groups_per_user_in_one_query(session: Session):
+    today = date(2024, 3, 10)
+    midnight = datetime(2024, 3, 10)
+    fridge = add_user(session, "alice", "Fridge")
+    cellar = add_user(session, "bob", "Cellar")
+    pantry = add_user(session, "carol", "Pantry", is_activated=False)
+    session.add_all(
+        [
+            Article(name="Milk", storage_id=fridge.id, expiration_date=midnight + timedelta(days=2)),
+            Article(name="Cheese", storage_id=fridge.id, expiration_date=midnight + timedelta(days=1)),
+            Article(name="Jam", storage_id=fridge.id, expiration_date=midnight + timedelta(days=30)),
+            Article(name="Old", storage_id=fridge.id, expiration_date=midnight - timedelta(days=1)),
+            Article(name="Wine", storage_id=cellar.id, expiration_date=midnight + timedelta(days=3, hours=20)),
+            Article(name="Flour", storage_id=pantry.id, expiration_date=midnight + timedelta(days=1)),
+        ]
+    )
+    session.commit()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(session.get_bind(), "before_cursor_execute", listener)
+    digests = upcoming_expirations(session, today, days=3)
+    event.remove(session.get_bind(), "before_cursor_execute", listener)
+
+    assert len(statements) == 1
+    assert [(user.name, [(article.name, name) for article, name in rows]) for user, rows in digests] == [
+        ("alice", [("Cheese", "Fridge"), ("Milk", "Fridge")]),
+        ("bob", [("Wine", "Cellar")]),
+    ]
+
+
+def test_send_digests_through_pluggable_transport(session: Session, outbox: mail_sending.LocalTransport):
+    for i in range(6):
+        storage = add_user(session, f"user{i}", "Fridge")
+        session.add(Article(name="Milk", storage_id=storage.id, expiration_date=datetime.today() + timedelta(days=1)))
+    session.commit()
+
+    assert send_digests(session, workers=3) == 6
+    assert sorted(message["to"] for message in outbox.sent) == [f"user{i}@mail.de" for i in range(6)]
+    assert all("Milk" in message["html"] and "Milk" in message["text"] for message in outbox.sent)
+
+    # a second run on the same day, or another worker, finds every digest already sent
+    assert send_digests(session) == 0
+    assert len(outbox.sent) == 6
+    assert send_digests(session, as_of=date.today() + timedelta(days=1)) == 6
+
+
+def test_failed_digest_does_not_stop_the_others(session: Session):
+    for name in ["alice", "bob"]:
+        storage = add_user(session, name, "Fridge")
+        session.add(Article(name="Milk", storage_id=storage.id, expiration_date=datetime.today()))
+    session.commit()
+    sent = []
+
+    def flaky(message: dict):
+        if message["to"].startswith("alice"):
+            raise ConnectionError("mail api down")
+        sent.append(message["to"])
+
+    previous = mail_sending.set_transport(flaky)
+    try:
+        assert send_digests(session) == 1
+    finally:
+        mail_sending.set_transport(previous)
+    assert sent == ["bob@mail.de"]
+
+    # the failed digest is released and goes out with the next run, bob does not get a second one
+    previous = mail_sending.set_transport(lambda message: sent.append(message["to"]))
+    try:
+        assert send_digests(session) == 1
+    finally:
+        mail_sending.set_transport(previous)
+    assert sent == ["bob@mail.de", "alice@mail.de"]
@@ -0,0 +1,52 @@
+import gzip
+import pathlib
+
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.import_openfoodfacts import import_dump
+from app.models import BarCodeCache
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def cached(engine) -> dict[str, str]:
+    with Session(engine) as session:
+        return {row.barcode: row.display_name for row in session.exec(select(BarCodeCache))}
+
+
+def test_import_jsonl(engine):
+    imported = import_dump(engine, FIXTURES / "openfoodfacts_sample.jsonl", batch_size=2)
+
+    assert imported == 4
+    assert cached(engine) == {
+        "4000000000011": "Vollmilch 3,5% (Weidemilch) - 1 l",
+        "4000000000028": "Butter (Kerrygold) - 250 g",
+        "4000000000035": "Apfelsaft (-) - -",
+    }
+
+
+def test_import_gzipped_csv_upserts(engine, tmp_path):
+    dump = tmp_path / "products.csv.gz"
+    dump.write_bytes(gzip.compress((FIXTURES / "openfoodfacts_sample.csv").read_bytes()))
+    with Session(engine) as session:
+        session.add(BarCodeCache(barcode="4000000000059", name="outdated"))
+        session.commit()
+
+    imported = import_dump(engine, dump)
+
+    assert imported == 2
+    assert cached(engine) == {
+        "4000000000059": "Quark (Milram) - 500 g",
+        "4000000000073": "Joghurt (-) - 150 g",
+    }
@@ -1,16 +1,24 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, timezone
+import json
 import sys
 import unittest
 
+import bcrypt
+
 from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import event
 from sqlmodel import Session, delete, select
 
 sys.path.append(".")
+from app.auth import BCRYPT_ROUNDS
+from app.controller_article import ARTICLE_PAGE_LENGTH, article_create
 from app.controller_storage import storage_create
-from app.controller_user import user_create
+from app.controller_user import create_admin, user_create, user_delete, user_update
+from app.fragments import storage_fragments
 from app.main import app
-from app.models import Article, Storage, User, UserStorage
-from app.utility import engine
+from app.models import Article, BarCodeCache, Storage, User, UserRegistration, UserStorage
+from app.utility import ALGORITHM, JWT_KEY, async_engine, engine, read_engine
 
 
 class TestWebInterface(unittest.TestCase):
@@ -30,16 +38,24 @@ class TestWebInterface(unittest.TestCase):
         self.assertEqual(response.status_code, 200, response.text)
         self.assertIn("access_token", response.json(), response.json())
         self.token = response.json()["access_token"]
+        # redirects only re-issue the cookie near expiry, so the client keeps it like a browser
+        self.client.cookies.set("access_token", f"Bearer {self.token}")
 
     def tearDown(self) -> None:
+        # the cleanup bypasses the write paths, so nothing invalidates the rendered storage tables
+        storage_fragments.clear()
+        # children first, the engine enforces foreign keys
         with Session(engine) as session:
-            session.exec(delete(User).where(User.name == "test"))
-            session.exec(delete(Storage).where(Storage.name == "testFridge"))
-            session.exec(delete(Storage).where(Storage.name == "testFreezer"))
             session.exec(delete(Article).where(Article.name == "testMilk"))
             session.exec(
                 delete(UserStorage).where(UserStorage.user_id == self.test_user.id)
             )
+            session.exec(delete(Storage).where(Storage.name == "testFridge"))
+            session.exec(delete(Storage).where(Storage.name == "testFreezer"))
+            session.exec(
+                delete(UserRegistration).where(UserRegistration.user_id == self.test_user.id)
+            )
+            session.exec(delete(User).where(User.name == "test"))
             session.commit()
 
     def test_login_view(self):
@@ -68,6 +84,18 @@ class TestWebInterface(unittest.TestCase):
             "Wrong Username or Password", response_fail.text, response_fail.text
         )
 
+    def test_login_rehashes_outdated_password_hash(self):
+        with Session(engine) as session:
+            user = session.get(User, self.test_user.id)
+            user.password_hash = bcrypt.hashpw(b"admin", bcrypt.gensalt(rounds=4)).decode()
+            session.commit()
+        response = self.client.post("/login", data={"name": "test", "password": "admin"})
+        self.assertIn("Login success", response.text)
+        with Session(engine) as session:
+            password_hash = session.get(User, self.test_user.id).password_hash
+        self.assertTrue(password_hash.startswith(f"$2b${BCRYPT_ROUNDS:02d}$"), password_hash)
+        self.assertTrue(bcrypt.checkpw(b"admin", password_hash.encode()))
+
     def test_storage_view(self):
         with Session(engine) as session:
             articles = session.exec(
@@ -87,6 +115,298 @@ class TestWebInterface(unittest.TestCase):
         self.assertEqual(response.status_code, 200, response.text)
         self.assertEqual(response.text.count("<tr>"), len(articles) + len(storages))
 
+    def test_storage_views_group_articles_per_storage(self):
+        today = datetime.today()
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            freezer_id = storage_create(session, self.test_user.id, "testFreezer").id
+            late, fridged, early = [
+                Article(name="testMilk", storage_id=freezer_id, expiration_date=today + timedelta(days=9)),
+                Article(name="testMilk", storage_id=fridge_id, expiration_date=today + timedelta(days=5)),
+                Article(name="testMilk", storage_id=freezer_id, expiration_date=today + timedelta(days=2)),
+            ]
+            session.add_all([late, fridged, early])
+            session.commit()
+            late_id, fridged_id, early_id = late.id, fridged.id, early.id
+        response = self.client.get("/storage")
+        self.assertEqual(response.status_code, 200, response.text)
+        fridge, freezer = response.text.split('id="testfridge"')[1].split('id="testfreezer"')
+        self.assertIn(f"/remove_article/{fridged_id}\"", fridge)
+        self.assertNotIn(f"/remove_article/{early_id}\"", fridge)
+        self.assertLess(
+            freezer.index(f"/remove_article/{early_id}\""), freezer.index(f"/remove_article/{late_id}\"")
+        )
+
+        response = self.client.get("/full_storage")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn(f"populate_storage_dialog({fridged_id},'testMilk',{fridge_id},'testFridge')", response.text)
+        self.assertIn(f"populate_storage_dialog({late_id},'testMilk',{freezer_id},'testFreezer')", response.text)
+
+    def test_article_table_pages_by_keyset(self):
+        today = datetime.today()
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            freezer_id = storage_create(session, self.test_user.id, "testFreezer").id
+            articles = [
+                Article(
+                    name="testMilk",
+                    storage_id=fridge_id if i % 3 else freezer_id,
+                    expiration_date=today + timedelta(days=i % 7),
+                )
+                for i in range(25)
+            ]
+            session.add_all(articles)
+            session.commit()
+            fridge_ids = [
+                article.id
+                for article in sorted(articles, key=lambda article: (article.expiration_date, article.id))
+                if article.storage_id == fridge_id
+            ]
+
+        def page(**params):
+            response = self.client.get(
+                "/article_table",
+                params={"storage_id": fridge_id, "draw": 3, "length": 5, "order[0][column]": 2} | params,
+            )
+            self.assertEqual(response.status_code, 200, response.text)
+            return response.json()
+
+        first = page()
+        self.assertEqual((first["draw"], first["recordsTotal"], first["recordsFiltered"]), (3, 16, 16))
+        self.assertEqual(len(first["data"]), 5)
+        self.assertIn(f"/remove_article/{fridge_ids[4]}\"", first["data"][-1][3])
+        by_keyset = page(start=5, after=json.dumps(first["cursor"]))
+        self.assertEqual(by_keyset["data"], page(start=5)["data"])
+        self.assertIn(f"/remove_article/{fridge_ids[5]}\"", by_keyset["data"][0][3])
+
+        last = page(**{"order[0][dir]": "desc"})
+        self.assertIn(f"/remove_article/{fridge_ids[-1]}\"", last["data"][0][3])
+
+        for bad in [
+            {"after": "not json"},
+            {"after": json.dumps({"a": 1})},
+            {"after": json.dumps(["soon", fridge_ids[4]])},
+            {"after": json.dumps([first["cursor"][0], "1"])},
+            {"order[0][column]": 9},
+            {"order[0][column]": -3},
+            {"order[0][column]": "name", "start": "x", "length": "all", "draw": "?"},
+        ]:
+            fallback = page(**bad)
+            self.assertIn(f"/remove_article/{fridge_ids[0]}\"", fallback["data"][0][3], bad)
+        self.assertIn(f"/remove_article/{fridge_ids[5]}\"", page(start=5, after="[")["data"][0][3])
+
+        everything = self.client.get("/article_table", params={"search[value]": "testfreezer"}).json()
+        self.assertEqual(everything["recordsFiltered"], 9)
+        self.assertTrue(all("testFreezer" in row[3] for row in everything["data"]))
+
+        with Session(engine) as session:
+            foreign = Storage(name="testFreezer")
+            session.add(foreign)
+            session.commit()
+            foreign_id = foreign.id
+        self.assertEqual(page(storage_id=foreign_id)["recordsTotal"], 0)
+
+    def test_full_storage_streams_all_articles(self):
+        today = datetime.today()
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            articles = [
+                Article(name="testMilk", storage_id=fridge_id, expiration_date=today + timedelta(days=30 - i))
+                for i in range(25)
+            ]
+            session.add_all(articles)
+            session.commit()
+            article_ids = [article.id for article in reversed(articles)]
+
+        paged = self.client.get("/full_storage")
+        self.assertIn("/full_storage?all=true", paged.text)
+        self.assertNotIn(f"/remove_article/{article_ids[ARTICLE_PAGE_LENGTH]}\"", paged.text)
+
+        response = self.client.get("/full_storage", params={"all": True})
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertNotIn("content-length", response.headers)
+        self.assertNotEqual(response.headers["ETag"], paged.headers["ETag"])
+        positions = [response.text.index(f"/remove_article/{article_id}\"") for article_id in article_ids]
+        self.assertEqual(positions, sorted(positions))
+        self.assertTrue(response.text.rstrip().endswith("</html>"))
+
+    def test_storage_view_answers_304_until_inventory_changes(self):
+        response = self.client.get("/storage")
+        etag = response.headers["ETag"]
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(read_engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            response = self.client.get("/storage", headers={"If-None-Match": etag})
+        finally:
+            event.remove(read_engine.sync_engine, "before_cursor_execute", listener)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("article", statements[0])
+
+        self.client.post("/create_storage", data={"storage_name": "testFridge"})
+        self.client.get("/storage")  # shows the flash message
+        response = self.client.get("/storage", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+        etag = response.headers["ETag"]
+        with Session(engine) as session:
+            fridge_id = session.exec(select(Storage.id).where(Storage.name == "testFridge")).one()
+            article_create(session, self.test_user.id, "testMilk", fridge_id, date.today())
+        response = self.client.get("/storage", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_storage_view_with_flash_messages_is_not_cached(self):
+        etag = self.client.get("/storage").headers["ETag"]
+        response = self.client.post("/create_storage", data={"storage_name": "testFridge"})
+        self.assertIn("testFridge", response.text)
+        self.assertNotIn("ETag", response.headers)
+        self.assertEqual(response.headers["Cache-Control"], "no-store")
+
+        response = self.client.get("/storage", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        self.assertEqual(self.client.get("/storage", headers={"If-None-Match": etag}).status_code, 304)
+
+        # a flash without an inventory change must not reuse the ETag of the unchanged page either
+        response = self.client.get("/remove_storage/0")
+        self.assertIn("Storage not found", response.text)
+        self.assertNotIn("ETag", response.headers)
+        self.assertEqual(self.client.get("/storage", headers={"If-None-Match": etag}).status_code, 304)
+
+    def test_read_views_load_owned_storages_once(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            article_create(session, self.test_user.id, "testMilk", fridge_id, date.today())
+        self.client.get("/storage")  # caches the principal
+        storage_fragments.clear()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(read_engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            self.assertEqual(self.client.get("/storage").status_code, 200)
+            storage_statements = len(statements)
+            response = self.client.get("/checkin_date", params={"name": "testMilk", "storage_id": fridge_id})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            event.remove(read_engine.sync_engine, "before_cursor_execute", listener)
+        # inventory version, owned storages and the first pages with their counts
+        self.assertEqual(storage_statements, 4, statements)
+        # valid_storage and User.storages share the one query of the owned storages
+        self.assertEqual(len(statements) - storage_statements, 1, statements[storage_statements:])
+
+    def test_storage_view_renders_only_changed_storage_tables(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            freezer_id = storage_create(session, self.test_user.id, "testFreezer").id
+        self.client.get("/storage")
+        statements = []
+        listener = lambda *args: statements.append((args[2], args[3]))
+        event.listen(read_engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            response = self.client.get("/storage")
+            self.assertFalse([statement for statement, _ in statements if "FROM article" in statement])
+
+            with Session(engine) as session:
+                article_create(session, self.test_user.id, "testMilk", fridge_id, date.today())
+            statements.clear()
+            response = self.client.get("/storage")
+        finally:
+            event.remove(read_engine.sync_engine, "before_cursor_execute", listener)
+        article_queries = [parameters for statement, parameters in statements if "FROM article" in statement]
+        self.assertTrue(article_queries)
+        # the freezer table came from the fragment cache, only the fridge was queried
+        self.assertEqual(
+            article_queries,
+            [(self.test_user.id, fridge_id, ARTICLE_PAGE_LENGTH), (self.test_user.id, fridge_id)],
+        )
+        fridge, freezer = response.text.split('id="testfridge"')[1].split('id="testfreezer"')
+        self.assertIn("testMilk", fridge)
+        self.assertNotIn("testMilk", freezer)
+
+    def test_storage_view_counts_days_as_of_request_date(self):
+        today = datetime.combine(date.today(), datetime.min.time())
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            session.add_all(
+                [
+                    Article(name="testMilk", storage_id=fridge_id, expiration_date=today - timedelta(days=3)),
+                    Article(name="testMilk", storage_id=fridge_id, expiration_date=today + timedelta(days=5)),
+                    Article(
+                        name="testMilk", storage_id=fridge_id, expiration_date=today + timedelta(days=6, hours=23)
+                    ),
+                ]
+            )
+            session.commit()
+        response = self.client.get("/storage")
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn("(3 Days overdue)", response.text)
+        self.assertIn("(5 Days remaining)", response.text)
+        self.assertIn("(6 Days remaining)", response.text)
+
+    def test_authenticated_requests_skip_user_query(self):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        cookies = {"access_token": f"Bearer {self.token}"}
+        self.client.get("/storage", cookies=cookies)
+        event.listen(async_engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            response = self.client.get("/storage", cookies=cookies)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([statement for statement in statements if "FROM user" in statement])
+
+            with Session(engine) as session:
+                user_update(session, self.test_user.id, email="changed@mail.de")
+            statements.clear()
+            self.client.get("/storage", cookies=cookies)
+            self.assertTrue([statement for statement in statements if "FROM user" in statement])
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", listener)
+
+    def test_migrate_creates_the_admin_only_once(self):
+        with Session(engine) as session:
+            self.assertEqual(len(session.exec(select(User).where(User.name == "admin")).all()), 1)
+            self.assertIsNone(create_admin(session))
+            self.assertEqual(len(session.exec(select(User).where(User.name == "admin")).all()), 1)
+
+    def test_user_delete_removes_registration_and_storage_links(self):
+        with Session(engine) as session:
+            storage_create(session, self.test_user.id, "testFridge")
+            session.add(UserRegistration(token="test-token", user_id=self.test_user.id))
+            session.commit()
+            user_delete(session, self.test_user.id)
+            self.assertIsNone(session.get(User, self.test_user.id))
+            self.assertIsNone(session.get(UserRegistration, "test-token"))
+            self.assertEqual(
+                session.exec(select(UserStorage).where(UserStorage.user_id == self.test_user.id)).all(), []
+            )
+
+    def test_redirect_reuses_token_until_refresh_window(self):
+        response = self.client.post(
+            "/create_storage",
+            data={"storage_name": "testFridge"},
+            cookies={"access_token": f"Bearer {self.token}"},
+            follow_redirects=False,
+        )
+        self.assertEqual(response.status_code, 303)
+        self.assertNotIn("access_token", response.cookies)
+
+        expiring_token = jwt.encode(
+            {"sub": "test", "exp": datetime.now(timezone.utc) + timedelta(minutes=5)},
+            JWT_KEY,
+            algorithm=ALGORITHM,
+        )
+        response = self.client.post(
+            "/create_storage",
+            data={"storage_name": "testFreezer"},
+            cookies={"access_token": f"Bearer {expiring_token}"},
+            follow_redirects=False,
+        )
+        self.assertEqual(response.status_code, 303)
+        self.assertNotEqual(response.cookies["access_token"], f'"Bearer {expiring_token}"')
+
     def test_storage_create_remove_recreate_view(self):
         # create storage
         response = self.client.post(
@@ -270,6 +590,33 @@ class TestWebInterface(unittest.TestCase):
             )
             self.assertIsNone(test_storage, response.content)
 
+    def test_storage_remove_with_articles(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            session.add_all([Article(name="testMilk", storage_id=fridge_id) for _ in range(3)])
+            session.commit()
+        response = self.client.get("/storage")
+        self.assertIn(f"/remove_storage/{fridge_id}?with_articles=true", response.text)
+        response = self.client.get(f"/remove_storage/{fridge_id}")
+        self.assertIn("Storage not empty, 3 entries in Storage", response.text)
+
+        response = self.client.get(f"/remove_storage/{fridge_id}", params={"with_articles": True})
+        self.assertIn("Storage testFridge removed", response.text)
+        with Session(engine) as session:
+            self.assertIsNone(session.get(Storage, fridge_id))
+            self.assertEqual(session.exec(select(Article).where(Article.storage_id == fridge_id)).all(), [])
+            self.assertEqual(session.exec(select(UserStorage).where(UserStorage.storage_id == fridge_id)).all(), [])
+
+    def test_storage_delete_cascades_in_the_database(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            session.add(Article(name="testMilk", storage_id=fridge_id))
+            session.commit()
+            session.exec(delete(Storage).where(Storage.id == fridge_id))
+            session.commit()
+            self.assertEqual(session.exec(select(Article).where(Article.storage_id == fridge_id)).all(), [])
+            self.assertEqual(session.exec(select(UserStorage).where(UserStorage.storage_id == fridge_id)).all(), [])
+
     def test_checkin_view(self):
         with Session(engine) as session:
             articles = session.exec(
@@ -313,6 +660,101 @@ class TestWebInterface(unittest.TestCase):
         )
         # Add more assertions for the expected behavior
 
+    def test_checkin_batch_json(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            freezer_id = storage_create(session, self.test_user.id, "testFreezer").id
+            session.add(BarCodeCache(barcode="test-0001", name="testMilk"))
+            session.commit()
+        response = self.client.post(
+            "/checkin_batch",
+            json=[
+                {"name": "testMilk", "storage_id": fridge_id, "expiration_date": "2030-01-01", "quantity": 2},
+                {"name": "testMilk", "storage_id": freezer_id, "expiration_date": "2030-02-01"},
+                {"barcode": "test-0001", "storage_id": freezer_id, "expiration_date": "2030-03-01"},
+            ],
+            cookies={"access_token": f"Bearer {self.token}"},
+        )
+        with Session(engine) as session:
+            session.exec(delete(BarCodeCache).where(BarCodeCache.barcode == "test-0001"))
+            session.commit()
+            articles = sorted(
+                (article.name, article.storage_id, article.quantity)
+                for article in session.exec(
+                    select(Article).where(Article.storage_id.in_([fridge_id, freezer_id]))
+                )
+            )
+            session.exec(delete(Article).where(Article.name == "testMilk (-) - -"))
+            session.commit()
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json()["created"], 3)
+        self.assertEqual(
+            articles,
+            [
+                ("testMilk", fridge_id, 2),
+                ("testMilk", freezer_id, 1),
+                ("testMilk (-) - -", freezer_id, 1),
+            ],
+        )
+
+    def test_checkin_batch_form_rejects_foreign_storage(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            foreign = Storage(name="testFreezer")
+            session.add(foreign)
+            session.commit()
+            foreign_id = foreign.id
+        response = self.client.post(
+            "/checkin_batch",
+            data={
+                "barcode": ["", ""],
+                "name": ["testMilk", "testMilk"],
+                "storage_id": [fridge_id, foreign_id],
+                "expiration_date": ["2030-01-01", "2030-01-01"],
+                "quantity": [1, 1],
+            },
+            cookies={"access_token": f"Bearer {self.token}"},
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn("Invalid storage", response.text)
+        with Session(engine) as session:
+            self.assertEqual(
+                session.exec(select(Article).where(Article.name == "testMilk")).all(), []
+            )
+
+    def test_checkin_batch_rejects_malformed_entries(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+        cookies = {"access_token": f"Bearer {self.token}"}
+        entry = {"name": "testMilk", "storage_id": fridge_id, "expiration_date": "2030-01-01"}
+        for payload, message in [
+            ([entry, "testMilk"], "Expected a list of article objects"),
+            ({"articles": entry}, "Expected a list of article objects"),
+            ([entry, entry | {"quantity": 0}], "Article 2: quantity"),
+            ([entry | {"price": -1}], "Article 1: price"),
+            ([{"name": "testMilk", "storage_id": fridge_id}], "Article 1: expiration_date"),
+        ]:
+            response = self.client.post("/checkin_batch", json=payload, cookies=cookies)
+            self.assertEqual(response.status_code, 400, response.text)
+            self.assertIn(message, response.json()["message"])
+        response = self.client.post(
+            "/checkin_batch",
+            data={
+                "barcode": ["", ""],
+                "name": ["testMilk", "testMilk"],
+                "storage_id": [fridge_id, fridge_id],
+                "expiration_date": ["2030-01-01"],
+                "quantity": [1, 1],
+            },
+            cookies=cookies,
+        )
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertIn("Every article needs", response.text)
+        with Session(engine) as session:
+            self.assertEqual(
+                session.exec(select(Article).where(Article.name == "testMilk")).all(), []
+            )
+
     def test_checkin_date_view(self):
         with Session(engine) as session:
             storage_first = storage_create(
@@ -374,6 +816,97 @@ class TestWebInterface(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         # Add more assertions for the expected behavior
 
+    def test_move_article_to_foreign_storage_is_rejected(self):
+        with Session(engine) as session:
+            storage_id = storage_create(session, self.test_user.id, "testFridge").id
+            foreign = Storage(name="testFreezer")
+            article = Article(name="testMilk", storage_id=storage_id)
+            session.add_all([foreign, article])
+            session.commit()
+            foreign_id, article_id = foreign.id, article.id
+        response = self.client.post(
+            "/move_article",
+            data={"article_id": article_id, "storage_id": foreign_id},
+            cookies={"access_token": f"Bearer {self.token}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        with Session(engine) as session:
+            self.assertEqual(session.get(Article, article_id).storage_id, storage_id)
+
+    def test_reduce_quantity_consumes_units_atomically(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            foreign = Storage(name="testFreezer")
+            session.add(foreign)
+            session.commit()
+            milk = Article(name="testMilk", storage_id=fridge_id, quantity=5)
+            foreign_milk = Article(name="testMilk", storage_id=foreign.id, quantity=5)
+            session.add_all([milk, foreign_milk])
+            session.commit()
+            milk_id, foreign_milk_id = milk.id, foreign_milk.id
+
+        response = self.client.get(f"/reduce_quantity/{milk_id}", params={"units": 2})
+        self.assertIn("Quantity reduced to 3", response.text)
+        self.client.get(f"/reduce_quantity/{milk_id}")
+        response = self.client.get(f"/reduce_quantity/{foreign_milk_id}", params={"units": 2})
+        self.assertIn("Article not found", response.text)
+        with Session(engine) as session:
+            self.assertEqual(session.get(Article, milk_id).quantity, 2)
+            self.assertEqual(session.get(Article, foreign_milk_id).quantity, 5)
+
+        response = self.client.get(f"/reduce_quantity/{milk_id}", params={"units": 5})
+        self.assertIn("Quantity reduced to 0", response.text)
+        with Session(engine) as session:
+            self.assertIsNone(session.get(Article, milk_id))
+
+    def test_bulk_article_actions(self):
+        with Session(engine) as session:
+            fridge_id = storage_create(session, self.test_user.id, "testFridge").id
+            freezer_id = storage_create(session, self.test_user.id, "testFreezer").id
+            foreign = Storage(name="testFreezer")
+            session.add(foreign)
+            session.commit()
+            articles = [
+                Article(name="testMilk", storage_id=fridge_id, quantity=1, expiration_date=datetime(2030, 1, 1)),
+                Article(name="testMilk", storage_id=fridge_id, quantity=3, expiration_date=datetime(2030, 2, 27)),
+                Article(name="testMilk", storage_id=foreign.id, quantity=1, expiration_date=datetime(2030, 1, 1)),
+            ]
+            session.add_all(articles)
+            session.commit()
+            single_id, triple_id, foreign_id = [article.id for article in articles]
+            foreign_storage_id = foreign.id
+        selected = {"article_ids": [single_id, triple_id, foreign_id]}
+
+        response = self.client.get("/full_storage")
+        self.assertIn(f'name="article_ids" value="{single_id}" form="bulk-form"', response.text)
+        response = self.client.post("/articles/move", data=selected | {"storage_id": freezer_id})
+        self.assertIn("2 articles moved", response.text)
+        response = self.client.post("/articles/move", data=selected | {"storage_id": foreign_storage_id})
+        self.assertIn("Invalid storage", response.text)
+        response = self.client.post("/articles/shift_expiration", data=selected | {"days": 4})
+        self.assertIn("Expiration date of 2 articles shifted by 4 days", response.text)
+        with Session(engine) as session:
+            moved = [session.get(Article, article_id) for article_id in (single_id, triple_id)]
+            self.assertEqual({article.storage_id for article in moved}, {freezer_id})
+            self.assertEqual([article.expiration_date for article in moved], [datetime(2030, 1, 5), datetime(2030, 3, 3)])
+            self.assertEqual(session.get(Article, foreign_id).storage_id, foreign_storage_id)
+            self.assertEqual(session.get(Article, foreign_id).expiration_date, datetime(2030, 1, 1))
+        self.client.post("/articles/shift_expiration", data=selected | {"days": -5})
+        with Session(engine) as session:
+            self.assertEqual(session.get(Article, single_id).expiration_date, datetime(2029, 12, 31))
+
+        response = self.client.post("/articles/consume", data=selected | {"units": 2})
+        self.assertIn("Quantity of 2 articles reduced by 2", response.text)
+        with Session(engine) as session:
+            self.assertIsNone(session.get(Article, single_id))
+            self.assertEqual(session.get(Article, triple_id).quantity, 1)
+
+        response = self.client.post("/articles/remove", data=selected)
+        self.assertIn("1 articles removed", response.text)
+        with Session(engine) as session:
+            self.assertIsNone(session.get(Article, triple_id))
+            self.assertEqual(session.get(Article, foreign_id).quantity, 1)
+
     def test_remove_article_view(self):
         response = self.client.get(
             "/remove_article/1", cookies={"access_token": f"Bearer {self.token}"}
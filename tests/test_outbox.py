@@ -0,0 +1,69 @@
+import json
+import sys
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+sys.path.append(".")
+from app import mail_sending
+from app.controller_user import user_create
+from app.models import MailOutbox, UserRegistration
+from app.outbox import OUTBOX_MAX_ATTEMPTS, deliver_batch, queue_mail, retry_delay
+
+
+def message(to: str) -> dict:
+    return {"from": "test@mail.de", "to": to, "subject": "Hello", "html": "<p>Hello</p>", "text": "Hello"}
+
+
+def test_registration_only_queues_the_mail(session: Session, outbox: mail_sending.LocalTransport):
+    user = user_create(session, "outbox", "secret", "outbox@mail.de", with_registration=True)
+    assert not user.is_activated
+    assert outbox.sent == []
+    queued = session.exec(select(MailOutbox)).one()
+    token = session.exec(select(UserRegistration.token)).one()
+    assert json.loads(queued.message)["to"] == "outbox@mail.de"
+    assert token in json.loads(queued.message)["text"]
+
+    assert deliver_batch(session) == 1
+    assert [mail["to"] for mail in outbox.sent] == ["outbox@mail.de"]
+    assert session.get(MailOutbox, queued.id).sent_at is not None
+    assert deliver_batch(session) == 0
+
+
+def test_failed_mails_are_retried_with_backoff(session: Session):
+    queue_mail(session, message("a@mail.de"))
+    session.commit()
+    attempts = []
+
+    def failing(message: dict):
+        attempts.append(message["to"])
+        raise ConnectionError("mail api down")
+
+    previous = mail_sending.set_transport(failing)
+    try:
+        now = datetime.today()
+        assert deliver_batch(session, now=now) == 1
+        mail = session.exec(select(MailOutbox)).one()
+        assert (mail.attempts, mail.last_error, mail.sent_at) == (1, "mail api down", None)
+        assert mail.next_attempt_at == now + retry_delay(1)
+        assert deliver_batch(session, now=now + retry_delay(1) - timedelta(seconds=1)) == 0
+
+        later = now
+        for _ in range(OUTBOX_MAX_ATTEMPTS - 1):
+            later = session.get(MailOutbox, mail.id).next_attempt_at
+            assert deliver_batch(session, now=later) == 1
+        assert deliver_batch(session, now=later + timedelta(days=1)) == 0
+    finally:
+        mail_sending.set_transport(previous)
+    assert len(attempts) == OUTBOX_MAX_ATTEMPTS
+    assert [retry_delay(n).total_seconds() for n in (1, 2, 3)] == [30, 60, 120]
+    assert retry_delay(20).total_seconds() == 3600
+
+
+def test_deliver_batch_sends_in_batches(session: Session, outbox: mail_sending.LocalTransport):
+    for i in range(5):
+        queue_mail(session, message(f"user{i}@mail.de"))
+    session.commit()
+    assert deliver_batch(session, batch_size=3) == 3
+    assert deliver_batch(session, batch_size=3) == 2
+    assert [mail["to"] for mail in outbox.sent] == [f"user{i}@mail.de" for i in range(5)]
@@ -0,0 +1,84 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.controller_storage import storage_create
+from app.models import Article, Storage, User, UserStorage, scope_owned_storages
+from app.validators import valid_article, valid_storage
+
+
+@pytest.fixture
+def session():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for user_id, storage_name in [(1, "Fridge"), (2, "Cellar")]:
+            session.add(User(id=user_id, name=f"user{user_id}", password_hash="-", email=""))
+            session.add(Storage(id=user_id, name=storage_name))
+            session.add(UserStorage(user_id=user_id, storage_id=user_id))
+            session.add(Article(id=user_id, name=f"article{user_id}", storage_id=user_id))
+        session.commit()
+        yield session
+
+
+@pytest.fixture
+def statements(session):
+    executed = []
+    engine = session.get_bind()
+    listener = lambda *args: executed.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    yield executed
+    event.remove(engine, "before_cursor_execute", listener)
+
+
+def test_valid_storage_by_id_enforces_ownership(session, statements):
+    assert valid_storage(session, 1, 1).name == "Fridge"
+    assert valid_storage(session, 2, 1) is None
+    assert valid_storage(session, 3, 1) is None
+    assert len(statements) == 3
+
+
+def test_valid_storage_by_name_enforces_ownership(session, statements):
+    assert valid_storage(session, "Cellar", 2).id == 2
+    assert valid_storage(session, "Cellar", 1) is None
+    assert valid_storage(session, None, 1) is None
+    assert len(statements) == 2
+
+
+def test_valid_article_enforces_ownership(session, statements):
+    assert valid_article(session, 1, 1).name == "article1"
+    assert valid_article(session, 2, 1) is None
+    assert valid_article(session, 3, 1) is None
+    assert len(statements) == 3
+
+
+def test_scoped_session_checks_ownership_from_memory(session, statements):
+    scope_owned_storages(session, 1)
+    user = session.get(User, 1)
+    statements.clear()
+
+    assert [storage.name for storage in user.storages(session)] == ["Fridge"]
+    assert valid_storage(session, 1, 1).name == "Fridge"
+    assert valid_storage(session, "Fridge", 1).id == 1
+    assert valid_storage(session, 2, 1) is None
+    assert valid_storage(session, "Cellar", 1) is None
+    article = valid_article(session, 1, 1)
+    assert article.name == "article1"
+    assert valid_article(session, 2, 1) is None
+    assert valid_article(session, 1, 1) is article
+
+    # one ownership query, articles are then only loaded by primary key once each
+    assert len([statement for statement in statements if "userstorage" in statement]) == 1
+    assert len(statements) == 3
+
+
+def test_scoped_session_sees_new_storages(session):
+    scope_owned_storages(session, 1)
+    assert valid_storage(session, "Freezer", 1) is None
+
+    storage_create(session, 1, "Freezer")
+
+    assert valid_storage(session, "Freezer", 1).name == "Freezer"